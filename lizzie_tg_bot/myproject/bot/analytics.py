@@ -0,0 +1,192 @@
+import os
+import asyncio
+import logging
+from dotenv import load_dotenv
+from bot import history_io
+from bot import openers
+
+logger = logging.getLogger(__name__)
+
+# Нові рядки chat_history згортаються в агрегати із затримкою, щоб не пропустити незакомічені вставки
+SETTLE_SECONDS = 10
+BATCH_ROWS = 100000
+# Схема перевіряється один раз на процес: ALTER TABLE бере ексклюзивний замок навіть без змін
+schema_ready = False
+
+
+# Уся схема бота: історія, агрегати, готові відповіді. Викликається явно, а не під час імпорту,
+# тож команди й дашборд працюють і з базою, де бот ще не запускався
+def create_schema(conn):
+    global schema_ready
+    with conn.cursor() as cursor:
+        history_io.create_history_tables(cursor)
+        create_aggregate_tables(cursor)
+        openers.create_opener_tables(cursor)
+    conn.commit()
+    schema_ready = True
+
+
+# Таблиці агрегатів: дашборд читає лише їх, а не chat_history
+def create_aggregate_tables(cursor):
+    cursor.execute("""
+        ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS latency_ms INTEGER;
+
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day DATE PRIMARY KEY,
+            messages_in INTEGER NOT NULL DEFAULT 0,
+            messages_out INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0,
+            llm_calls INTEGER NOT NULL DEFAULT 0,
+            llm_latency_total_ms BIGINT NOT NULL DEFAULT 0,
+            llm_latency_max_ms INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS daily_active_users (
+            day DATE NOT NULL,
+            user_id TEXT NOT NULL,
+            PRIMARY KEY (day, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id TEXT PRIMARY KEY,
+            messages INTEGER NOT NULL DEFAULT 0,
+            first_seen TIMESTAMPTZ,
+            last_seen TIMESTAMPTZ
+        );
+        CREATE TABLE IF NOT EXISTS stats_watermark (
+            name TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL
+        );
+        INSERT INTO stats_watermark (name, last_id) VALUES ('chat_history', 0) ON CONFLICT DO NOTHING;
+    """)
+
+
+# Інкрементальне оновлення агрегатів: обробляються лише рядки chat_history з id після водяного знака
+def refresh_aggregates(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT last_id FROM stats_watermark WHERE name = 'chat_history' FOR UPDATE;")
+        low = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT max(id) FROM (
+                SELECT id FROM chat_history
+                WHERE id > %s AND created_at < now() - make_interval(secs => %s)
+                ORDER BY id LIMIT %s
+            ) AS batch;
+        """, (low, SETTLE_SECONDS, BATCH_ROWS))
+        high = cursor.fetchone()[0]
+        if high is None:
+            conn.rollback()
+            return 0
+
+        params = {"low": low, "high": high}
+        cursor.execute("""
+            INSERT INTO daily_stats (day, messages_in, messages_out, llm_calls, llm_latency_total_ms, llm_latency_max_ms)
+            SELECT created_at::date,
+                   count(*) FILTER (WHERE role = 'user'),
+                   count(*) FILTER (WHERE role = 'assistant'),
+                   count(latency_ms),
+                   COALESCE(sum(latency_ms), 0),
+                   COALESCE(max(latency_ms), 0)
+            FROM chat_history WHERE id > %(low)s AND id <= %(high)s
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET
+                messages_in = daily_stats.messages_in + EXCLUDED.messages_in,
+                messages_out = daily_stats.messages_out + EXCLUDED.messages_out,
+                llm_calls = daily_stats.llm_calls + EXCLUDED.llm_calls,
+                llm_latency_total_ms = daily_stats.llm_latency_total_ms + EXCLUDED.llm_latency_total_ms,
+                llm_latency_max_ms = GREATEST(daily_stats.llm_latency_max_ms, EXCLUDED.llm_latency_max_ms);
+        """, params)
+        cursor.execute("""
+            WITH inserted AS (
+                INSERT INTO daily_active_users (day, user_id)
+                SELECT DISTINCT created_at::date, user_id FROM chat_history
+                WHERE id > %(low)s AND id <= %(high)s AND role = 'user'
+                ON CONFLICT DO NOTHING
+                RETURNING day
+            )
+            UPDATE daily_stats d SET active_users = d.active_users + n.count
+            FROM (SELECT day, count(*) FROM inserted GROUP BY day) AS n
+            WHERE d.day = n.day;
+        """, params)
+        cursor.execute("""
+            INSERT INTO user_stats (user_id, messages, first_seen, last_seen)
+            SELECT user_id, count(*), min(created_at), max(created_at)
+            FROM chat_history WHERE id > %(low)s AND id <= %(high)s AND role = 'user'
+            GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                messages = user_stats.messages + EXCLUDED.messages,
+                first_seen = LEAST(user_stats.first_seen, EXCLUDED.first_seen),
+                last_seen = GREATEST(user_stats.last_seen, EXCLUDED.last_seen);
+        """, params)
+        openers.rollup_openers(cursor, low, high)
+        cursor.execute("UPDATE stats_watermark SET last_id = %s WHERE name = 'chat_history';", (high,))
+    conn.commit()
+    return high - low
+
+
+# Скидання агрегатів і водяного знака: наступне оновлення перерахує все з chat_history.
+# Потрібне після перенесення історії (migrate_history), яке вставляє рядки з новими id
+def reset_aggregates(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT last_id FROM stats_watermark WHERE name = 'chat_history' FOR UPDATE;")
+        cursor.execute("TRUNCATE daily_stats, daily_active_users, user_stats, opener_stats;")
+        cursor.execute("UPDATE stats_watermark SET last_id = 0 WHERE name = 'chat_history';")
+    conn.commit()
+
+
+# Підключення до PostgreSQL за DATABASE_URL з .env (при першому підключенні створюється схема)
+def connect():
+    load_dotenv()
+    conn = history_io.connect(os.getenv("DATABASE_URL"))
+    if not schema_ready:
+        try:
+            create_schema(conn)
+        except Exception:
+            conn.close()
+            raise
+    return conn
+
+
+# Оновлення агрегатів до поточного стану (кількома пакетами за потреби)
+def refresh_all(rebuild=False):
+    conn = connect()
+    try:
+        if rebuild:
+            reset_aggregates(conn)
+        while refresh_aggregates(conn):
+            pass
+    finally:
+        conn.close()
+
+
+# Фонове оновлення агрегатів у процесі бота
+async def refresh_periodically(interval):
+    while True:
+        try:
+            await asyncio.to_thread(refresh_all)
+        except Exception as e:
+            logger.error(f"❌ Помилка оновлення статистики: {e}")
+        await asyncio.sleep(interval)
+
+
+# Дані для дашборду: лише невеликі таблиці агрегатів
+def dashboard_data(conn, days=30):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT day, messages_in, messages_out, active_users, llm_calls,
+                   CASE WHEN llm_calls > 0 THEN llm_latency_total_ms / llm_calls END, llm_latency_max_ms
+            FROM daily_stats ORDER BY day DESC LIMIT %s;
+        """, (days,))
+        daily = cursor.fetchall()
+        cursor.execute("SELECT count(*), COALESCE(sum(messages), 0) FROM user_stats;")
+        total_users, total_messages = cursor.fetchone()
+        cursor.execute("SELECT user_id, messages, last_seen FROM user_stats ORDER BY messages DESC LIMIT 10;")
+        top_users = cursor.fetchall()
+        cursor.execute("SELECT last_id FROM stats_watermark WHERE name = 'chat_history';")
+        watermark = cursor.fetchone()
+    return {
+        "daily": daily,
+        "total_users": total_users,
+        "total_messages": total_messages,
+        "top_users": top_users,
+        "watermark": watermark[0] if watermark else 0,
+    }
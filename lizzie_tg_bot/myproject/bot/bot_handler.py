@@ -6,10 +6,21 @@ import psycopg2
 import ollama
 import asyncio
 import random
+import signal
+import collections
 from dotenv import load_dotenv
-from urllib.parse import urlparse
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, CallbackContext
+from bot.lifecycle import UpdateTracker, load_json
+from bot import memory
+from bot.question_bank import QuestionBank
+from bot.prompts import persona_prompts, build_reply_messages, build_follow_up_messages
+from bot import watchdog
+from bot import analytics
+from bot import llm
+from bot import db
+from bot import openers
+from bot.db import connect_db, release_db
 
 # Завантаження змінних середовища
 load_dotenv()
@@ -22,65 +33,44 @@ if os.path.exists(CONFIG_FILE):
 else:
     raise ValueError("❌ Файл config.json не знайдено!")
 
-# Токен і база даних
-TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# База даних (токени ботів перевіряються під час завантаження персон)
 DATABASE_URL = os.getenv("DATABASE_URL")
-if not TOKEN or not DATABASE_URL:
-    raise ValueError("❌ TELEGRAM_BOT_TOKEN і DATABASE_URL не знайдено у .env!")
+if not DATABASE_URL:
+    raise ValueError("❌ DATABASE_URL не знайдено у .env!")
 
 # Логування
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Функція підключення до PostgreSQL
-def connect_db():
-    try:
-        result = urlparse(DATABASE_URL)
-        conn = psycopg2.connect(
-            dbname=result.path[1:], user=result.username, password=result.password,
-            host=result.hostname, port=result.port, sslmode='disable', client_encoding='UTF8'
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"❌ Помилка підключення до бази даних: {e}")
-        return None
+# Спільний для всіх персон пул з'єднань PostgreSQL
+db.configure(DATABASE_URL, config.get("database", {}).get("pool_size", 10))
 
 # Створення таблиць
 def create_tables():
     conn = connect_db()
-    if conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id TEXT PRIMARY KEY,
-                    language TEXT DEFAULT 'українська',
-                    age INTEGER
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS chat_history (
-                    id SERIAL PRIMARY KEY,
-                    user_id TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    content TEXT NOT NULL
-                );
-            """)
-            conn.commit()
-        conn.close()
+    if not conn:
+        return
 
-create_tables()
+    try:
+        analytics.create_schema(conn)
+    finally:
+        release_db(conn)
 
 # Функція збереження повідомлення у базу
-def save_message(user_id, role, content):
+def save_message(user_id, role, content, latency_ms=None):
     conn = connect_db()
-    if conn:
+    if not conn:
+        return
+
+    try:
         with conn.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO chat_history (user_id, role, content) VALUES (%s, %s, %s);",
-                (user_id, role, content)
+                "INSERT INTO chat_history (user_id, role, content, latency_ms) VALUES (%s, %s, %s, %s);",
+                (user_id, role, content, latency_ms)
             )
             conn.commit()
-        conn.close()
+    finally:
+        release_db(conn)
 
 # Функція отримання віку користувача
 def get_user_age(user_id):
@@ -88,11 +78,12 @@ def get_user_age(user_id):
     if not conn:
         return None
 
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT age FROM users WHERE user_id = %s;", (user_id,))
-        result = cursor.fetchone()
-
-    conn.close()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT age FROM users WHERE user_id = %s;", (user_id,))
+            result = cursor.fetchone()
+    finally:
+        release_db(conn)
     return result[0] if result else None
 
 # Функція збереження віку
@@ -101,15 +92,107 @@ def save_user_age(user_id, age):
     if not conn:
         return
 
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            INSERT INTO users (user_id, age) 
-            VALUES (%s, %s) 
-            ON CONFLICT (user_id) DO UPDATE SET age = EXCLUDED.age;
-        """, (user_id, age))
-        conn.commit()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO users (user_id, age) 
+                VALUES (%s, %s) 
+                ON CONFLICT (user_id) DO UPDATE SET age = EXCLUDED.age;
+            """, (user_id, age))
+            conn.commit()
+    finally:
+        release_db(conn)
+
+# Функція отримання мови користувача
+def get_user_language(user_id):
+    conn = connect_db()
+    if not conn:
+        return None
 
-    conn.close()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT language FROM users WHERE user_id = %s;", (user_id,))
+            result = cursor.fetchone()
+    finally:
+        release_db(conn)
+    return result[0] if result else None
+
+# Функція збереження мови
+def save_user_language(user_id, language):
+    conn = connect_db()
+    if not conn:
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO users (user_id, language) 
+                VALUES (%s, %s) 
+                ON CONFLICT (user_id) DO UPDATE SET language = EXCLUDED.language;
+            """, (user_id, language))
+            conn.commit()
+    finally:
+        release_db(conn)
+
+# Функція отримання останніх повідомлень користувача (у хронологічному порядку)
+def get_recent_messages(user_id, limit):
+    conn = connect_db()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT role, content FROM (
+                    SELECT id, role, content FROM chat_history
+                    WHERE user_id = %s ORDER BY id DESC LIMIT %s
+                ) AS recent ORDER BY id;
+            """, (user_id, limit))
+            rows = cursor.fetchall()
+    finally:
+        release_db(conn)
+    return [{"role": role, "content": content} for role, content in rows]
+
+# Банк уточнювальних питань: пули з config.json плюс згенеровані офлайн
+QUESTION_CONFIG = config.get("question_bank", {})
+LANGUAGE_POOLS = {"українська": "uk", "english": "en"}
+
+def load_question_bank():
+    generated = load_json(QUESTION_CONFIG.get("generated_file", "question_bank.json"), {})
+    pools = {
+        name: questions + generated.get(name, [])
+        for name, questions in QUESTION_CONFIG.get("pools", {}).items()
+    }
+    return QuestionBank(pools, QUESTION_CONFIG.get("state_file", "question_state.json"))
+
+question_bank = load_question_bank()
+
+# Персони: кілька ботів зі своїми токенами, промптами і лімітами в одному процесі
+def load_personas():
+    personas = []
+    for index, persona in enumerate(config.get("personas") or [{"name": "lizzie"}]):
+        token_env = persona.get("token_env", "TELEGRAM_BOT_TOKEN")
+        token = os.getenv(token_env)
+        if not token:
+            raise ValueError(f"❌ {token_env} для персони {persona['name']} не знайдено у .env!")
+        system_prompt, follow_up_prompt = persona_prompts(persona)
+        personas.append({
+            "name": persona["name"],
+            "token": token,
+            "bot_name": persona.get("bot_name", config["bot_name"]),
+            "language_model": persona.get("language_model", config["language_model"]),
+            "system_prompt": system_prompt,
+            "follow_up_prompt": follow_up_prompt,
+            "max_concurrent_llm": persona.get("max_concurrent_llm", 2),
+            # Перша персона зберігає історію під звичайним chat_id (сумісно з наявними даними)
+            "key_prefix": "" if index == 0 else f"{persona['name']}:",
+            "state_file": "bot_state.json" if index == 0 else f"bot_state_{persona['name']}.json",
+        })
+    return personas
+
+# Ключ користувача в межах персони (історія, вік, мова, пам'ять, питання)
+def user_key(update: Update, context: CallbackContext):
+    return context.bot_data["persona"]["key_prefix"] + str(update.message.chat_id)
 
 # Функція вибору мови
 async def choose_language(update: Update, context: CallbackContext):
@@ -117,9 +200,27 @@ async def choose_language(update: Update, context: CallbackContext):
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_text("Оберіть мову / Choose a language:", reply_markup=reply_markup)
 
+# Кеш мов користувачів: мова змінюється лише через change_language, тож читаємо її з бази один раз
+LANGUAGE_CACHE_USERS = 10000
+user_languages = collections.OrderedDict()
+
+async def user_language(user_id):
+    if user_id in user_languages:
+        user_languages.move_to_end(user_id)
+        return user_languages[user_id]
+    language = await asyncio.to_thread(get_user_language, user_id)
+    remember_language(user_id, language)
+    return language
+
+def remember_language(user_id, language):
+    user_languages[user_id] = language
+    user_languages.move_to_end(user_id)
+    while len(user_languages) > LANGUAGE_CACHE_USERS:
+        user_languages.popitem(last=False)
+
 # Функція зміни мови
 async def change_language(update: Update, context: CallbackContext):
-    user_id = str(update.message.chat_id)
+    user_id = user_key(update, context)
     lang = update.message.text.strip().lower()
 
     if lang == "українська":
@@ -128,83 +229,249 @@ async def change_language(update: Update, context: CallbackContext):
         response = "Language changed to English! 🎉"
     else:
         response = "Оберіть мову з кнопок / Please select a language from the buttons."
+        await update.message.reply_text(response)
+        return
+
+    await asyncio.to_thread(save_user_language, user_id, lang)
+    remember_language(user_id, lang)
+    question_bank.reset(user_id)
 
     await update.message.reply_text(response)
 
 # Функція привітання
 async def start(update: Update, context: CallbackContext):
-    user_id = str(update.message.chat_id)
-    save_user_age(user_id, random.randint(18, 25))  # Випадковий вік при старті
+    user_id = user_key(update, context)
+    await asyncio.to_thread(save_user_age, user_id, random.randint(18, 25))  # Випадковий вік при старті
     await choose_language(update, context)
 
-# Функція отримання відповіді від Ollama
-async def get_ollama_response(user_text):
-    try:
-        prompt_messages = [
-            {"role": "system", "content": "Говори коротко, вільно та невимушено. Не вважай себе штучним інтелектом, а справжньою людиною."},
-            {"role": "user", "content": user_text}
-        ]
+# Налаштування довготривалої пам'яті
+MEMORY_CONFIG = config.get("memory", {})
+
+# Коротка історія розмови в промпті: скільки повідомлень і для скількох користувачів тримати в пам'яті
+HISTORY_MESSAGES = config.get("llm", {}).get("history_messages", 20)
+HISTORY_USERS = config.get("llm", {}).get("history_users", 1000)
+
+# Історія користувача для промпту (при першому зверненні — з бази)
+async def load_history(context: CallbackContext, user_id):
+    histories = context.bot_data.setdefault("histories", collections.OrderedDict())
+    turns = histories.pop(user_id, None)
+    if turns is None:
+        turns = await asyncio.to_thread(get_recent_messages, user_id, HISTORY_MESSAGES)
+    histories[user_id] = turns
+    while len(histories) > HISTORY_USERS:
+        histories.popitem(last=False)
+    return turns
+
+# Історія лише дописується; обрізається рідко і одразу наполовину, щоб префікс промпту
+# (і KV-кеш Ollama) зберігався між ходами
+def append_history(turns, user_text, reply):
+    turns.append({"role": "user", "content": user_text})
+    turns.append({"role": "assistant", "content": reply})
+    if len(turns) > HISTORY_MESSAGES:
+        del turns[:len(turns) - HISTORY_MESSAGES // 2]
 
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: ollama.chat(model=config["language_model"], messages=prompt_messages))
+# Відповідь користувачу, коли модель недоступна (у пам'ять не записується)
+FALLBACK_RESPONSE = "Щось пішло не так 😅"
 
-        return response.get("message", {}).get("content", "Щось пішло не так 😅").strip()
+# Функція отримання відповіді від Ollama (None, якщо модель не відповіла)
+async def get_ollama_response(prompt_messages, persona, user_id):
+    try:
+        response = await llm.chat(persona["language_model"], prompt_messages, persona["llm_slots"], user_id)
+        content = response.get("message", {}).get("content")
+        return content.strip() if content else None
 
     except Exception as e:
         logger.error(f"❌ Помилка отримання відповіді від Ollama: {e}")
-        return "Щось пішло не так 😅"
+        return None
 
-# Функція генерації запитання по темі
-async def generate_follow_up_question(user_text):
+# Функція генерації запитання по темі (продовжує запит відповіді, щоб повторно використати його префікс)
+async def generate_follow_up_question(reply_messages, response_text, persona, user_id):
     try:
-        prompt_messages = [
-            {"role": "system", "content": "На основі цієї розмови, придумай коротке запитання, щоб підтримати діалог."},
-            {"role": "user", "content": user_text}
-        ]
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(None, lambda: ollama.chat(model=config["language_model"], messages=prompt_messages))
+        prompt_messages = build_follow_up_messages(reply_messages, response_text, persona["follow_up_prompt"])
+        response = await llm.chat(persona["language_model"], prompt_messages, persona["llm_slots"], user_id)
         return response.get("message", {}).get("content", "").strip()
     except Exception as e:
         logger.error(f"❌ Помилка генерації запитання: {e}")
         return ""
 
+# Шаблонні відповіді не потребують моделі
+GREETINGS = ["привіт", "hi", "hello"]
+
+def is_canned(user_text):
+    return user_text in GREETINGS or "як тебе звати" in user_text or "скільки тобі років" in user_text or "твій вік" in user_text
+
 # Функція обробки повідомлень
 async def handle_message(update: Update, context: CallbackContext):
-    user_id = str(update.message.chat_id)
+    persona = context.bot_data["persona"]
+    user_id = user_key(update, context)
     user_text = update.message.text.strip().lower()
 
-    save_message(user_id, "user", user_text)
-    logger.info(f"📩 Отримано повідомлення від {user_id}: {user_text}")
+    turns = await load_history(context, user_id)
+    await asyncio.to_thread(save_message, user_id, "user", user_text)
+    logger.info(f"📩 [{persona['name']}] Отримано повідомлення від {user_id}: {user_text}")
 
-    if user_text in ["привіт", "hi", "hello"]:
+    memories = None
+    latency_ms = None
+    language = None
+    response_text = None
+    prompt_messages = None
+    if user_text in GREETINGS:
         response_text = "Привіт! 😊"
     elif "як тебе звати" in user_text:
-        response_text = "Мене звати Ліззі! 😊"
+        response_text = f"Мене звати {persona['bot_name']}! 😊"
     elif "скільки тобі років" in user_text or "твій вік" in user_text:
-        age = get_user_age(user_id)
+        age = await asyncio.to_thread(get_user_age, user_id)
         response_text = f"Мені {age} років!"
-    else:
-        response_text = await get_ollama_response(user_text)
+    elif OPENERS_CONFIG.get("enabled") and openers.is_opener(turns, user_text):
+        # Часті короткі повідомлення на початку розмови: відповідь, підготовлена заздалегідь, поки модель простоювала
+        language = await user_language(user_id)
+        response_text = await asyncio.to_thread(openers.take_reply, persona["name"], language, user_text)
+        if response_text:
+            memories = []
+            logger.info(f"🧊 [{persona['name']}] Готова відповідь для {user_id}")
 
-    follow_up_question = await generate_follow_up_question(user_text) if random.random() < 0.5 else ""
+    if response_text is None:
+        memories = await memory.recall(user_id, user_text, MEMORY_CONFIG) if MEMORY_CONFIG.get("enabled") else []
+        prompt_messages = build_reply_messages(user_text, memories, persona["system_prompt"], turns)
+        started = time.perf_counter()
+        response_text = await get_ollama_response(prompt_messages, persona, user_id)
+        latency_ms = int((time.perf_counter() - started) * 1000)
+        if response_text is None:
+            # Збій моделі — не розмова: не запам'ятовуємо його
+            response_text = FALLBACK_RESPONSE
+            memories = None
+
+    follow_up_question = ""
+    if random.random() < 0.5:
+        if language is None:
+            language = await user_language(user_id)
+        pool = LANGUAGE_POOLS.get(language, "uk")
+        if QUESTION_CONFIG.get("enabled"):
+            follow_up_question = question_bank.next_question(user_id, pool)
+        if not follow_up_question:
+            # Той самий запит, що й для відповіді, тож уточнення продовжує його префікс
+            reply_messages = prompt_messages or build_reply_messages(user_text, memories or (), persona["system_prompt"], turns)
+            follow_up_question = await generate_follow_up_question(reply_messages, response_text, persona, user_id)
     final_response = response_text + (" " + follow_up_question if follow_up_question else "")
 
-    save_message(user_id, "assistant", final_response)
+    await asyncio.to_thread(save_message, user_id, "assistant", final_response, latency_ms)
+    # В історію йде те, що користувач справді побачив, разом з уточнювальним запитанням
+    append_history(turns, user_text, final_response)
     await update.message.reply_text(final_response)
 
+    # Запам'ятовуємо лише розмови, а не шаблонні відповіді
+    if MEMORY_CONFIG.get("enabled") and memories is not None:
+        await memory.remember(user_id, user_text, response_text, MEMORY_CONFIG)
+
+# Спільний для всіх персон ліміт одночасних запитів до Ollama, сервери та час утримання моделі в пам'яті
+LLM_CONFIG = config.get("llm", {})
+llm.configure(LLM_CONFIG.get("max_concurrent", 2), LLM_CONFIG.get("hosts", []), LLM_CONFIG.get("keep_alive"))
+
+# Сторож циклу подій (налаштовується через LOOP_WATCHDOG* у .env)
+loop_watchdog = watchdog.from_env()
+if loop_watchdog:
+    loop_watchdog.guard(ollama, "chat")
+    loop_watchdog.guard(psycopg2, "connect")
+    loop_watchdog.guard(time, "sleep")
+    loop_watchdog.guard(os, "fsync")
+
+# Фонове оновлення агрегатів статистики для адмін-дашборду
+ANALYTICS_CONFIG = config.get("analytics", {})
+
+# Готові відповіді для частих повідомлень (частоти рахуються під час оновлення статистики)
+OPENERS_CONFIG = config.get("openers", {})
+
+# Функція створення застосунку персони з власним трекером оновлень
+def build_application(persona):
+    tracker = UpdateTracker(persona["state_file"])
+    app = Application.builder().token(persona["token"]).concurrent_updates(True).build()
+    app.bot_data["persona"] = dict(persona, llm_slots=asyncio.Semaphore(persona["max_concurrent_llm"]))
+    app.bot_data["tracker"] = tracker
+    app.add_handler(TypeHandler(Update, tracker.begin), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(MessageHandler(filters.Regex("^(Українська|English)$"), change_language))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    app.add_handler(TypeHandler(Update, tracker.finish), group=100)
+    return app
+
+# Зупинка: спершу перестаємо отримувати оновлення, потім чекаємо відповідей, що ще генеруються.
+# Файли пишуться в потоках, тож суворий сторож циклу не перериває зупинку посередині
+async def shutdown(apps):
+    for app in apps:
+        if app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        await app.bot_data["tracker"].drain()
+        await app.shutdown()
+        await app.bot_data["tracker"].flush()
+    await asyncio.to_thread(memory.flush_all)
+    await asyncio.to_thread(question_bank.flush)
+    llm.report()
+
+# Запуск усіх персон в одному циклі подій до сигналу зупинки
+async def run_personas(personas):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    # На Windows цикл подій не підтримує add_signal_handler: звичайний обробник сигналу
+    # передає зупинку в цикл через call_soon_threadsafe
+    loop_signals = True
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            loop_signals = False
+            signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(stop_event.set))
+
+    await asyncio.to_thread(create_tables)
+    if loop_watchdog:
+        loop_watchdog.start()
+    background_tasks = [asyncio.create_task(question_bank.flush_periodically())]
+    if ANALYTICS_CONFIG.get("enabled"):
+        background_tasks.append(asyncio.create_task(analytics.refresh_periodically(ANALYTICS_CONFIG.get("refresh_interval", 60))))
+
+    apps = []
+    try:
+        for persona in personas:
+            app = build_application(persona)
+            await app.initialize()
+            apps.append(app)
+            # Повторно обробляємо оновлення, перервані збоєм
+            await app.bot_data["tracker"].replay(app)
+            await app.updater.start_polling()
+            await app.start()
+            logger.info(f"🚀 Бот {persona['name']} запущений!")
+
+        if OPENERS_CONFIG.get("enabled"):
+            background_tasks.append(asyncio.create_task(openers.precompute_periodically(
+                [app.bot_data["persona"] for app in apps], OPENERS_CONFIG, is_canned
+            )))
+        await stop_event.wait()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await shutdown(apps)
+        if loop_watchdog:
+            loop_watchdog.stop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            if loop_signals:
+                loop.remove_signal_handler(sig)
+            else:
+                signal.signal(sig, signal.default_int_handler if sig == signal.SIGINT else signal.SIG_DFL)
+
 # Функція запуску бота
 def run_telegram_bot():
+    personas = load_personas()
+    delay = 5
     while True:
         try:
-            app = Application.builder().token(TOKEN).concurrent_updates(True).build()
-            app.add_handler(CommandHandler("start", start))
-            app.add_handler(MessageHandler(filters.Regex("^(Українська|English)$"), change_language))
-            app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-            logger.info("🚀 Бот запущений!")
-            app.run_polling()
+            asyncio.run(run_personas(personas))
+            logger.info("🛑 Бот зупинено")
+            break
         except Exception as e:
-            logger.error(f"❌ Помилка: {e}")
-            time.sleep(5)
+            logger.error(f"❌ Помилка: {e}, перезапуск через {delay} с")
+            time.sleep(delay)
+            delay = min(delay * 2, 300)
 
 if __name__ == "__main__":
     run_telegram_bot()
@@ -0,0 +1,60 @@
+import logging
+import threading
+import psycopg2
+import psycopg2.pool
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Спільний для всіх персон і фонових задач пул з'єднань PostgreSQL
+DATABASE_URL = None
+POOL_SIZE = 10
+# Скільки чекати вільного з'єднання, перш ніж повідомити про помилку
+POOL_TIMEOUT = 30
+pool = None
+slots = threading.BoundedSemaphore(POOL_SIZE)
+pool_lock = threading.Lock()
+
+
+def configure(database_url, pool_size=10):
+    global DATABASE_URL, POOL_SIZE, slots
+    DATABASE_URL = database_url
+    POOL_SIZE = pool_size
+    slots = threading.BoundedSemaphore(pool_size)
+
+
+# Функція підключення до PostgreSQL (з'єднання береться з пулу, чекаючи вільного).
+# Кожне отримане з'єднання обов'язково повертається через release_db у finally
+def connect_db():
+    global pool
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        logger.error(f"❌ Немає вільного з'єднання з базою даних понад {POOL_TIMEOUT} с")
+        return None
+    try:
+        with pool_lock:
+            if pool is None:
+                result = urlparse(DATABASE_URL)
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, POOL_SIZE,
+                    dbname=result.path[1:], user=result.username, password=result.password,
+                    host=result.hostname, port=result.port, sslmode='disable', client_encoding='UTF8'
+                )
+        return pool.getconn()
+    except Exception as e:
+        slots.release()
+        logger.error(f"❌ Помилка підключення до бази даних: {e}")
+        return None
+
+
+# Функція повернення з'єднання до пулу; зламане з'єднання закривається, а не повертається
+def release_db(conn):
+    broken = bool(conn.closed)
+    try:
+        if not broken:
+            conn.rollback()
+    except psycopg2.Error:
+        broken = True
+    try:
+        pool.putconn(conn, close=broken)
+    finally:
+        slots.release()
@@ -0,0 +1,238 @@
+import io
+import os
+import csv
+import json
+import itertools
+import psycopg2
+import psycopg2.extras
+from urllib.parse import urlparse
+
+# Відповідність мов між JSON-історією ("uk"/"en") та таблицею users ("українська"/"english")
+LANGUAGE_CODES = {"українська": "uk", "english": "en"}
+LANGUAGE_NAMES = {code: name for name, code in LANGUAGE_CODES.items()}
+
+CHUNK_SIZE = 1 << 20
+
+
+# Підключення до PostgreSQL за DATABASE_URL
+def connect(database_url):
+    result = urlparse(database_url)
+    return psycopg2.connect(
+        dbname=result.path[1:], user=result.username, password=result.password,
+        host=result.hostname, port=result.port, sslmode='disable', client_encoding='UTF8'
+    )
+
+
+# Таблиці користувачів та історії чатів (спільні для бота й команди перенесення)
+def create_history_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            language TEXT DEFAULT 'українська',
+            age INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS chat_history_user_id ON chat_history (user_id, id);
+    """)
+
+
+class _JsonStream:
+    """Буферизоване читання JSON-файлу частинами з декодуванням по одному значенню."""
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos] if self.pos < len(self.buffer) else ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Очікувався символ {char!r} на позиції {self.pos}")
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+# Потокове читання chat_history.json: {user_id: {language, context}} по одному користувачу
+def iter_json(path):
+    with open(path, "r", encoding="utf-8") as file:
+        stream = _JsonStream(file)
+        if stream.peek() == "":
+            return
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            user_id = stream.decode()
+            stream.expect(":")
+            yield str(user_id), stream.decode()
+            if stream.peek() == ",":
+                stream.pos += 1
+                continue
+            stream.expect("}")
+            return
+
+
+# Потокове читання історії з PostgreSQL серверним курсором, згруповане за користувачем.
+# Частина користувачів (worker із workers) і продовження після after відбираються в SQL
+def iter_postgres(conn, itersize=5000, worker=0, workers=1, after=None):
+    conditions = ["TRUE"]
+    params = []
+    if workers > 1:
+        conditions.append("(hashtext(c.user_id) & 2147483647) %% %s = %s")
+        params += [workers, worker]
+    if after is not None:
+        conditions.append("c.user_id > %s")
+        params.append(after)
+    with conn.cursor(name="history_export") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(f"""
+            SELECT c.user_id, u.language, c.role, c.content, c.created_at
+            FROM chat_history c LEFT JOIN users u ON u.user_id = c.user_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY c.user_id, c.id;
+        """, params)
+        for user_id, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+            context = []
+            language = None
+            for _, language, role, content, created_at in rows:
+                context.append({"role": role, "content": content, "created_at": created_at.isoformat()})
+            yield user_id, {"language": LANGUAGE_CODES.get(language, language or "uk"), "context": context}
+
+
+class PostgresWriter:
+    """Запис історії в PostgreSQL пакетами через COPY.
+
+    Історія кожного користувача в пакеті замінюється повністю в одній
+    транзакції, тому повторний запис пакета після збою не дублює рядки.
+    Час повідомлення переноситься з поля created_at; якщо його немає
+    (стара JSON-історія), записується рядок 'now' — PostgreSQL розуміє
+    його як час транзакції. Рядки отримують нові id, тож після перенесення
+    агрегати статистики слід перебудувати: refresh_stats --rebuild.
+    """
+
+    def __init__(self, conn, batch_size=5000):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.users = []
+        self.rows = 0
+
+    def write(self, user_id, data):
+        self.users.append((user_id, data))
+        self.rows += len(data.get("context", []))
+        return self.rows >= self.batch_size
+
+    def flush(self):
+        if not self.users:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for user_id, data in self.users:
+            for message in data.get("context", []):
+                writer.writerow((user_id, message["role"], message["content"], message.get("created_at", "now")))
+        buffer.seek(0)
+
+        languages = [
+            (user_id, LANGUAGE_NAMES.get(data.get("language"), data.get("language") or "українська"))
+            for user_id, data in self.users
+        ]
+        with self.conn.cursor() as cursor:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO users (user_id, language) VALUES %s
+                ON CONFLICT (user_id) DO UPDATE SET language = EXCLUDED.language;
+            """, languages)
+            cursor.execute("DELETE FROM chat_history WHERE user_id = ANY(%s);", ([user_id for user_id, _ in self.users],))
+            cursor.copy_expert("COPY chat_history (user_id, role, content, created_at) FROM STDIN WITH (FORMAT csv)", buffer)
+        self.conn.commit()
+        self.users = []
+        self.rows = 0
+
+    def position(self):
+        return 0
+
+
+class JsonPartWriter:
+    """Запис записів "user_id": {...} у файл-частину, яка потім зливається в chat_history.json.
+
+    При відновленні файл обрізається до розміру з контрольної точки, тож
+    записи, не підтверджені контрольною точкою, не дублюються.
+    """
+
+    def __init__(self, path, size=0, batch_size=5000):
+        self.batch_size = batch_size
+        self.rows = 0
+        self.file = open(path, "ab")
+        self.file.truncate(size)
+        self.file.seek(size)
+
+    def write(self, user_id, data):
+        prefix = b",\n" if self.file.tell() else b""
+        entry = json.dumps(user_id, ensure_ascii=False) + ": " + json.dumps(data, ensure_ascii=False)
+        self.file.write(prefix + entry.encode("utf-8"))
+        self.rows += len(data.get("context", []))
+        return self.rows >= self.batch_size
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.rows = 0
+
+    def position(self):
+        return self.file.tell()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+# Злиття файлів-частин у єдиний JSON-об'єкт без завантаження в пам'ять
+def merge_json_parts(part_paths, output_path):
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as output:
+        output.write(b"{\n")
+        first = True
+        for part_path in part_paths:
+            if not os.path.exists(part_path) or os.path.getsize(part_path) == 0:
+                continue
+            if not first:
+                output.write(b",\n")
+            with open(part_path, "rb") as part:
+                while chunk := part.read(CHUNK_SIZE):
+                    output.write(chunk)
+            first = False
+        output.write(b"\n}\n")
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(tmp_path, output_path)
@@ -0,0 +1,150 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+import collections
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, CallbackContext
+
+logger = logging.getLogger(__name__)
+
+# Файл стану бота: останній оброблений update_id та незавершені оновлення
+STATE_FILE = "bot_state.json"
+DRAIN_TIMEOUT = 30
+# Скільки останніх оброблених update_id пам'ятати для відсіювання дублікатів
+RECENT_UPDATES = 1000
+# Стан зберігається пакетно, не частіше ніж раз на PERSIST_INTERVAL секунд
+PERSIST_INTERVAL = 1.0
+
+
+# Атомарний запис JSON: пишемо у тимчасовий файл і підміняємо через rename
+def atomic_write_json(path, data, indent=4, separators=None):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, indent=indent, separators=separators)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Читання JSON-файлу з поверненням значення за замовчуванням
+def load_json(path, default):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except json.JSONDecodeError:
+        logger.error(f"❌ Пошкоджений файл {path}, використовуємо значення за замовчуванням")
+        return default
+
+
+class UpdateTracker:
+    """Відстежує оновлення в обробці та зберігає контрольну точку update_id.
+
+    Оновлення, що були в обробці під час аварійного завершення, зберігаються
+    у файлі стану і повторно ставляться в чергу при наступному запуску.
+    Дублікати відсіюються за вікном останніх RECENT_UPDATES оброблених
+    update_id, а не за «більше/менше» контрольної точки: після тижня без
+    оновлень Telegram починає нумерацію з випадкового числа.
+    Стан пишеться на диск пакетно у фоні, не на шляху обробки кожного
+    оновлення, тож збій може втратити лише останні PERSIST_INTERVAL секунд.
+    """
+
+    def __init__(self, state_file=STATE_FILE, persist_interval=PERSIST_INTERVAL):
+        self.state_file = state_file
+        self.persist_interval = persist_interval
+        state = load_json(state_file, {})
+        self.last_update_id = state.get("last_update_id", 0)
+        self._replay = state.get("in_flight", {})
+        self._in_flight = {}
+        self._recent = collections.deque(state.get("recent", []), maxlen=RECENT_UPDATES)
+        self._recent_ids = set(self._recent)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._lock = asyncio.Lock()
+        self._persist_task = None
+
+    # Обробник першої групи: реєструє оновлення або відкидає дублікат
+    async def begin(self, update: Update, context: CallbackContext):
+        update_id = update.update_id
+        if update_id in self._in_flight or update_id in self._recent_ids:
+            logger.info(f"⏭️ Пропускаємо вже оброблене оновлення {update_id}")
+            raise ApplicationHandlerStop
+
+        self._in_flight[update_id] = update.to_dict()
+        self._idle.clear()
+        self._schedule_persist()
+
+    # Обробник останньої групи: позначає оновлення як завершене
+    async def finish(self, update: Update, context: CallbackContext):
+        update_id = update.update_id
+        if self._in_flight.pop(update_id, None) is None:
+            return
+
+        self._mark_done(update_id)
+        if not self._in_flight:
+            self._idle.set()
+        self._schedule_persist()
+
+    # Вікно останніх оброблених оновлень: найстаріші витісняються
+    def _mark_done(self, update_id):
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_ids.discard(self._recent[0])
+        self._recent.append(update_id)
+        self._recent_ids.add(update_id)
+        self.last_update_id = update_id
+
+    def _snapshot(self):
+        return {
+            "last_update_id": self.last_update_id,
+            "in_flight": {str(update_id): data for update_id, data in self._in_flight.items()},
+            "recent": list(self._recent),
+        }
+
+    # Відкладене збереження: усі зміни за persist_interval пишуться одним записом
+    def _schedule_persist(self):
+        if self._persist_task is None or self._persist_task.done():
+            self._persist_task = asyncio.create_task(self._persist_later())
+
+    # Скасувати можна лише очікування: запис, що вже почався, завершується під замком,
+    # інакше старий знімок із потоку міг би підмінити фінальний
+    async def _persist_later(self):
+        await asyncio.sleep(self.persist_interval)
+        await asyncio.shield(self.persist())
+
+    # Збереження стану у фоновому потоці, щоб не блокувати цикл подій
+    async def persist(self):
+        async with self._lock:
+            await asyncio.to_thread(atomic_write_json, self.state_file, self._snapshot())
+
+    # Повторна постановка в чергу оновлень, не завершених до збою
+    async def replay(self, application):
+        pending = sorted(self._replay.items(), key=lambda item: int(item[0]))
+        self._replay = {}
+        for update_id, data in pending:
+            if int(update_id) in self._recent_ids:
+                continue
+            logger.info(f"🔁 Повторна обробка оновлення {update_id} після збою")
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+    # Очікування завершення оновлень, що ще обробляються
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не дочекалися {len(self._in_flight)} оновлень, вони будуть оброблені після перезапуску")
+
+    # Фінальне збереження стану після того, як завершився фоновий запис
+    async def flush(self):
+        if self._persist_task:
+            self._persist_task.cancel()
+        await self.persist()
+        logger.info(f"💾 Стан збережено, останній update_id: {self.last_update_id}")
@@ -0,0 +1,111 @@
+import zlib
+import asyncio
+import logging
+import ollama
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Спільний для всіх персон пул потоків: обмежує кількість одночасних запитів до Ollama в процесі
+MAX_CONCURRENT = 2
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT, thread_name_prefix="ollama")
+# Окремий потік для фонової генерації: вона не займає місць живих запитів у executor
+background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-background")
+
+# Необов'язкові кілька серверів Ollama: чат завжди йде на той самий сервер, де його префікс уже в KV-кеші
+clients = []
+keep_alive = None
+
+# Кількість живих запитів, що виконуються зараз: фонова генерація поступається їм
+in_flight = 0
+
+# Статистика оцінки промптів і генерації за моделями (з полів відповіді Ollama)
+stats = {}
+
+
+def configure(max_concurrent, hosts=(), keep_alive_for=None):
+    global executor, clients, keep_alive
+    executor.shutdown(wait=False)
+    executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="ollama")
+    clients = [ollama.Client(host=host) for host in hosts]
+    keep_alive = keep_alive_for
+
+
+# Вибір сервера для чату (прив'язка сесії за ключем користувача)
+def _call(model, messages, affinity_key):
+    if not clients:
+        return ollama.chat(model=model, messages=messages, keep_alive=keep_alive)
+    index = zlib.crc32(str(affinity_key).encode("utf-8")) % len(clients) if affinity_key is not None else 0
+    return clients[index].chat(model=model, messages=messages, keep_alive=keep_alive)
+
+
+def record(model, response):
+    model_stats = stats.setdefault(model, {
+        "calls": 0, "prompt_eval_count": 0, "prompt_eval_ns": 0, "eval_count": 0, "eval_ns": 0
+    })
+    model_stats["calls"] += 1
+    for field, key in (("prompt_eval_count", "prompt_eval_count"), ("prompt_eval_duration", "prompt_eval_ns"),
+                       ("eval_count", "eval_count"), ("eval_duration", "eval_ns")):
+        model_stats[key] += response.get(field) or 0
+    logger.debug(
+        f"🧮 {model}: промпт {response.get('prompt_eval_count')} ток. за {(response.get('prompt_eval_duration') or 0) / 1e6:.0f} мс, "
+        f"генерація {response.get('eval_count')} ток. за {(response.get('eval_duration') or 0) / 1e6:.0f} мс"
+    )
+
+
+# Звіт: скільки токенів промпту реально оцінювалося (повторно використаний префікс сюди не входить)
+def report():
+    for model, model_stats in stats.items():
+        calls = model_stats["calls"]
+        eval_rate = model_stats["eval_count"] / (model_stats["eval_ns"] / 1e9) if model_stats["eval_ns"] else 0.0
+        logger.info(
+            f"📊 {model}: викликів {calls}, "
+            f"оцінка промпту в середньому {model_stats['prompt_eval_count'] / calls:.0f} ток. / {model_stats['prompt_eval_ns'] / calls / 1e6:.0f} мс, "
+            f"генерація {eval_rate:.1f} ток./с"
+        )
+
+
+def busy():
+    return in_flight > 0
+
+
+# Фонова генерація потоком токенів; щойно з'являється живий запит, потік закривається,
+# і Ollama припиняє генерацію для відключеного клієнта. Повертає None, якщо генерацію перервано
+def _background_call(model, messages):
+    client = clients[0] if clients else ollama
+    stream = client.chat(model=model, messages=messages, stream=True, keep_alive=keep_alive)
+    parts = []
+    try:
+        for chunk in stream:
+            if busy():
+                return None
+            parts.append(chunk.get("message", {}).get("content", ""))
+            if chunk.get("done"):
+                record(model, chunk)
+    finally:
+        stream.close()
+    return "".join(parts)
+
+
+async def background_chat(model, messages):
+    if busy():
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(background_executor, lambda: _background_call(model, messages))
+
+
+# Запит до Ollama через спільний пул; semaphore — власний ліміт персони
+async def chat(model, messages, semaphore=None, affinity_key=None):
+    global in_flight
+    loop = asyncio.get_running_loop()
+    in_flight += 1
+    try:
+        if semaphore is None:
+            response = await loop.run_in_executor(executor, lambda: _call(model, messages, affinity_key))
+        else:
+            async with semaphore:
+                response = await loop.run_in_executor(executor, lambda: _call(model, messages, affinity_key))
+    finally:
+        in_flight -= 1
+    record(model, response)
+    return response
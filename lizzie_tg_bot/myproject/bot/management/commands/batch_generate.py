@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from bot import llm
+from bot.lifecycle import load_json
+from bot.prompts import persona_prompts, build_reply_messages, build_follow_up_messages
+
+CONFIG_FILE = "config.json"
+
+# Побудова повідомлень тим самим шляхом, що й у бота, з промптами обраної персони
+BUILDERS = {
+    "reply": lambda item, system_prompt, follow_up_prompt: build_reply_messages(
+        item["prompt"], item.get("memories", ()), system_prompt, item.get("history", ())
+    ),
+    "follow_up": lambda item, system_prompt, follow_up_prompt: build_follow_up_messages(
+        build_reply_messages(item["prompt"], item.get("memories", ()), system_prompt, item.get("history", ())),
+        item.get("reply", ""), follow_up_prompt
+    ),
+}
+
+
+# Перцентиль із відсортованого списку
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Читання завдань із JSONL: кожен рядок — {"prompt": ..., "id"?, "kind"?, "memories"?, "history"?, "reply"?}
+def read_prompts(path):
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_number))
+            item.setdefault("kind", "reply")
+            yield item
+
+
+# Ідентифікатори вже оброблених пар (id, модель) для відновлення
+def read_done(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # обірваний останній рядок після збою
+            if "error" not in result:
+                done.add((str(result["id"]), result["model"]))
+    return done
+
+
+# Обрізання обірваного останнього рядка, щоб нові результати не дописалися в його продовження.
+# Файл читається з кінця частинами, а не цілком
+def truncate_partial_line(path, chunk_size=1 << 16):
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as file:
+        end = position = file.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - chunk_size)
+            file.seek(start)
+            chunk = file.read(position - start)
+            if position == end and chunk.endswith(b"\n"):
+                return
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            position = start
+        file.truncate(0)
+
+
+class Command(BaseCommand):
+    help = "Пакетно проганяє промпти з JSONL через Ollama без Telegram і рахує токени/с та затримки"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="JSONL-файл із промптами")
+        parser.add_argument("--output", default="batch_results.jsonl", help="JSONL-файл результатів")
+        parser.add_argument("--model", action="append", help="Модель (можна вказати кілька разів)")
+        parser.add_argument("--persona", help="Персона з config.json, чиї промпти і модель використовувати")
+        parser.add_argument("--concurrency", type=int, default=4, help="Кількість одночасних запитів")
+        parser.add_argument("--no-resume", action="store_true", help="Не пропускати вже оброблені промпти")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["input"]):
+            raise CommandError(f"❌ Файл {options['input']} не знайдено!")
+        if options["concurrency"] < 1:
+            raise CommandError("❌ Кількість одночасних запитів має бути не менше 1")
+
+        config = load_json(CONFIG_FILE, {})
+        persona = {}
+        if options["persona"]:
+            persona = next((item for item in config.get("personas", []) if item["name"] == options["persona"]), None)
+            if persona is None:
+                raise CommandError(f"❌ Персону {options['persona']} не знайдено у config.json")
+        options["prompts"] = persona_prompts(persona)
+        models = options["model"] or [persona.get("language_model", config.get("language_model", "mistral:latest"))]
+        truncate_partial_line(options["output"])
+        done = set() if options["no_resume"] else read_done(options["output"])
+        # Запити йдуть тим самим шляхом, що й у бота: сервери і keep_alive з налаштувань llm
+        llm_config = config.get("llm", {})
+        llm.configure(options["concurrency"], llm_config.get("hosts", []), llm_config.get("keep_alive"))
+
+        stats = asyncio.run(self.run(options, models, done))
+        self.report(stats)
+
+    async def run(self, options, models, done):
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        stats = {model: {"latencies": [], "eval_count": 0, "eval_seconds": 0.0, "prompt_eval_seconds": 0.0,
+                         "errors": 0, "started": None, "finished": None} for model in models}
+
+        with open(options["output"], "a", encoding="utf-8") as output:
+            async def generate(item, model):
+                model_stats = stats[model]
+                started = time.perf_counter()
+                model_stats["started"] = model_stats["started"] or started
+                try:
+                    messages = BUILDERS[item["kind"]](item, *options["prompts"])
+                    response = await llm.chat(model, messages, affinity_key=item["id"])
+                    latency = time.perf_counter() - started
+                    result = {
+                        "id": item["id"], "model": model,
+                        "response": response.get("message", {}).get("content", "").strip(),
+                        "latency": round(latency, 3),
+                        "prompt_eval_count": response.get("prompt_eval_count"),
+                        "prompt_eval_duration": response.get("prompt_eval_duration"),
+                        "eval_count": response.get("eval_count"),
+                        "eval_duration": response.get("eval_duration"),
+                    }
+                    model_stats["latencies"].append(latency)
+                    model_stats["eval_count"] += result["eval_count"] or 0
+                    model_stats["eval_seconds"] += (result["eval_duration"] or 0) / 1e9
+                    model_stats["prompt_eval_seconds"] += (result["prompt_eval_duration"] or 0) / 1e9
+                except Exception as e:
+                    model_stats["errors"] += 1
+                    result = {"id": item["id"], "model": model, "error": f"{type(e).__name__}: {e}"}
+                model_stats["finished"] = time.perf_counter()
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+
+            async def worker(item, model):
+                async with semaphore:
+                    await generate(item, model)
+
+            # Помилки задач не повинні зникати в asyncio.wait
+            def check(finished):
+                for task in finished:
+                    task.result()
+
+            # Обмежуємо кількість створених задач, щоб не читати весь файл у пам'ять
+            pending = set()
+            for item in read_prompts(options["input"]):
+                if item["kind"] not in BUILDERS:
+                    raise CommandError(f"❌ Невідомий тип промпту: {item['kind']}")
+                for model in models:
+                    if (str(item["id"]), model) in done:
+                        continue
+                    pending.add(asyncio.create_task(worker(item, model)))
+                    if len(pending) >= options["concurrency"] * 2:
+                        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        check(finished)
+            if pending:
+                finished, _ = await asyncio.wait(pending)
+                check(finished)
+
+        return stats
+
+    def report(self, stats):
+        for model, model_stats in stats.items():
+            latencies = sorted(model_stats["latencies"])
+            if not latencies:
+                self.stdout.write(f"{model}: немає нових результатів (помилок: {model_stats['errors']})")
+                continue
+            wall = model_stats["finished"] - model_stats["started"]
+            per_request = model_stats["eval_count"] / model_stats["eval_seconds"] if model_stats["eval_seconds"] else 0.0
+            throughput = model_stats["eval_count"] / wall if wall else 0.0
+            self.stdout.write(
+                f"📊 {model}: запитів {len(latencies)}, помилок {model_stats['errors']}\n"
+                f"   затримка, с: p50 {percentile(latencies, 0.5):.2f}, p90 {percentile(latencies, 0.9):.2f}, "
+                f"p99 {percentile(latencies, 0.99):.2f}, max {latencies[-1]:.2f}\n"
+                f"   генерація: {per_request:.1f} токенів/с на запит, {throughput:.1f} токенів/с сумарно\n"
+                f"   оцінка промпту: {model_stats['prompt_eval_seconds']:.2f} с сумарно"
+            )
@@ -0,0 +1,193 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
+from django.core.management.base import BaseCommand, CommandError
+from bot.lifecycle import atomic_write_json, load_json
+from bot import history_io
+from bot import analytics
+
+BACKENDS = ("json", "postgres")
+
+
+# Перенесення однієї частини користувачів; з PostgreSQL частина відбирається в SQL
+def migrate_partition(options, worker):
+    state_file = os.path.join(options["state_dir"], f"worker-{worker}.json")
+    state = load_json(state_file, {"ordinal": -1, "user_id": None, "bytes": 0})
+
+    source_conn = target_conn = None
+    if options["source"] == "postgres":
+        source_conn = history_io.connect(options["database_url"])
+        reader = history_io.iter_postgres(source_conn, worker=worker, workers=options["workers"], after=state.get("user_id"))
+    else:
+        reader = history_io.iter_json(options["input"])
+
+    if options["target"] == "postgres":
+        target_conn = history_io.connect(options["database_url"])
+        writer = history_io.PostgresWriter(target_conn, options["batch_size"])
+    else:
+        part_path = os.path.join(options["state_dir"], f"part-{worker}.json")
+        writer = history_io.JsonPartWriter(part_path, state["bytes"], options["batch_size"])
+
+    last_ordinal = state["ordinal"]
+    last_user_id = state.get("user_id")
+    migrated = 0
+
+    def checkpoint():
+        writer.flush()
+        atomic_write_json(state_file, {"ordinal": last_ordinal, "user_id": last_user_id, "bytes": writer.position()})
+
+    try:
+        for ordinal, (user_id, data) in enumerate(reader):
+            # JSON читається заново з початку, PostgreSQL — вже з after=user_id
+            if options["source"] == "json" and ordinal <= state["ordinal"]:
+                continue
+            last_ordinal = ordinal
+            last_user_id = user_id
+            migrated += 1
+            if writer.write(user_id, data):
+                checkpoint()
+        checkpoint()
+    finally:
+        if options["target"] == "json":
+            writer.close()
+        for conn in (source_conn, target_conn):
+            if conn:
+                conn.close()
+    return migrated
+
+
+# З'єднання процесу-записувача (по одному на процес пулу)
+_writer_conn = None
+
+
+def _init_writer(database_url):
+    global _writer_conn
+    _writer_conn = history_io.connect(database_url)
+
+
+def write_batch(batch):
+    writer = history_io.PostgresWriter(_writer_conn)
+    for user_id, data in batch:
+        writer.write(user_id, data)
+    writer.flush()
+    return len(batch)
+
+
+# JSON → PostgreSQL кількома процесами: файл розбирає один читач, процеси лише пишуть пакети через COPY.
+# Контрольна точка — останній користувач неперервного префікса завершених пакетів
+def migrate_json_parallel(options):
+    state_file = os.path.join(options["state_dir"], "reader.json")
+    done_ordinal = load_json(state_file, {"ordinal": -1})["ordinal"]
+    workers = options["workers"]
+    pending = {}
+    finished = {}
+    next_sequence = 0
+    migrated = 0
+
+    def collect(futures):
+        nonlocal next_sequence, done_ordinal, migrated
+        for future in futures:
+            sequence, last_ordinal = pending.pop(future)
+            migrated += future.result()
+            finished[sequence] = last_ordinal
+        while next_sequence in finished:
+            done_ordinal = finished.pop(next_sequence)
+            next_sequence += 1
+        atomic_write_json(state_file, {"ordinal": done_ordinal})
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_writer, initargs=(options["database_url"],)) as executor:
+        batch = []
+        rows = 0
+        sequence = 0
+        for ordinal, (user_id, data) in enumerate(history_io.iter_json(options["input"])):
+            if ordinal <= done_ordinal:
+                continue
+            batch.append((user_id, data))
+            rows += len(data.get("context", []))
+            if rows < options["batch_size"]:
+                continue
+            pending[executor.submit(write_batch, batch)] = (sequence, ordinal)
+            sequence += 1
+            batch = []
+            rows = 0
+            # Не більше двох пакетів на процес у черзі, щоб не тримати весь файл у пам'яті
+            if len(pending) >= workers * 2:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(completed)
+        if batch:
+            pending[executor.submit(write_batch, batch)] = (sequence, ordinal)
+        if pending:
+            completed, _ = wait(pending)
+            collect(completed)
+    return migrated
+
+
+class Command(BaseCommand):
+    help = "Переносить історію чатів між chat_history.json та PostgreSQL потоково, пакетами"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", choices=BACKENDS, required=True)
+        parser.add_argument("--target", choices=BACKENDS, required=True)
+        parser.add_argument("--input", default="chat_history.json", help="Вхідний JSON-файл історії")
+        parser.add_argument("--output", default="chat_history.json", help="Вихідний JSON-файл історії")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Кількість повідомлень у пакеті")
+        parser.add_argument("--workers", type=int, default=1, help="Кількість паралельних процесів")
+        parser.add_argument("--state-dir", default=".migrate_history", help="Каталог контрольних точок")
+        parser.add_argument("--reset", action="store_true", help="Почати заново, ігноруючи контрольні точки")
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        options["database_url"] = os.getenv("DATABASE_URL")
+        if "postgres" in (options["source"], options["target"]) and not options["database_url"]:
+            raise CommandError("❌ DATABASE_URL не знайдено у .env!")
+        if options["source"] == "json" and not os.path.exists(options["input"]):
+            raise CommandError(f"❌ Файл {options['input']} не знайдено!")
+        if options["source"] == options["target"] == "json" and options["input"] == options["output"]:
+            raise CommandError("❌ Вхідний і вихідний файли збігаються!")
+        if options["source"] == options["target"] == "postgres":
+            raise CommandError("❌ Джерело і ціль — та сама база: рядки видалялися б і вставлялися знову під час читання")
+        if options["workers"] < 1:
+            raise CommandError("❌ Кількість процесів має бути не менше 1")
+        if options["source"] == options["target"] == "json" and options["workers"] > 1:
+            # Вузьке місце — розбір одного файлу, додаткові процеси лише повторювали б його
+            self.stdout.write("⚠️ JSON → JSON виконується в одному процесі, --workers ігнорується")
+            options["workers"] = 1
+
+        if options["reset"]:
+            shutil.rmtree(options["state_dir"], ignore_errors=True)
+        os.makedirs(options["state_dir"], exist_ok=True)
+
+        # Кількість процесів фіксується при першому запуску, інакше розбиття на частини зміниться
+        settings_file = os.path.join(options["state_dir"], "settings.json")
+        saved = load_json(settings_file, None)
+        if saved and saved["workers"] != options["workers"]:
+            raise CommandError(f"❌ Перенесення розпочато з --workers {saved['workers']}, продовжіть з тим самим значенням або додайте --reset")
+        atomic_write_json(settings_file, {"workers": options["workers"]})
+
+        # Цільова база може бути новою: бот ще не запускався і таблиць немає
+        if options["target"] == "postgres":
+            conn = history_io.connect(options["database_url"])
+            try:
+                analytics.create_schema(conn)
+            finally:
+                conn.close()
+
+        workers = options["workers"]
+        if workers == 1:
+            totals = [migrate_partition(options, 0)]
+        elif options["source"] == "json":
+            totals = [migrate_json_parallel(options)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(migrate_partition, options, worker) for worker in range(workers)]
+                totals = [future.result() for future in futures]
+
+        if options["target"] == "json":
+            parts = [os.path.join(options["state_dir"], f"part-{worker}.json") for worker in range(workers)]
+            history_io.merge_json_parts(parts, options["output"])
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Перенесено користувачів: {sum(totals)}"))
+        if options["target"] == "postgres":
+            # Перенесені рядки мають нові id, тож інкрементальні агрегати порахували б їх удруге
+            self.stdout.write("⚠️ Перебудуйте статистику: python manage.py refresh_stats --rebuild")
@@ -0,0 +1,62 @@
+import re
+import ollama
+from django.core.management.base import BaseCommand, CommandError
+from bot.lifecycle import atomic_write_json, load_json
+
+CONFIG_FILE = "config.json"
+
+PROMPTS = {
+    "uk": "Придумай {count} коротких різних запитань, щоб підтримати невимушену розмову з другом. Кожне запитання з нового рядка, без нумерації.",
+    "en": "Come up with {count} short, varied questions to keep a casual conversation with a friend going. One question per line, no numbering.",
+}
+
+
+# Очищення рядка відповіді моделі від нумерації та маркерів списку
+def clean_question(line):
+    return re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+
+
+class Command(BaseCommand):
+    help = "Поповнює банк уточнювальних питань, генеруючи їх мовною моделлю офлайн"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pool", required=True, help="Назва пулу, наприклад uk або en")
+        parser.add_argument("--count", type=int, default=20, help="Скільки нових питань додати")
+        parser.add_argument("--batch", type=int, default=10, help="Скільки питань просити за один запит")
+        parser.add_argument("--model", help="Мовна модель (за замовчуванням з config.json)")
+        parser.add_argument("--max-requests", type=int, default=10, help="Обмеження кількості запитів до моделі")
+
+    def handle(self, *args, **options):
+        config = load_json(CONFIG_FILE, None)
+        if config is None:
+            raise CommandError("❌ Файл config.json не знайдено!")
+
+        bank_config = config.get("question_bank", {})
+        generated_file = bank_config.get("generated_file", "question_bank.json")
+        pool = options["pool"]
+        prompt = PROMPTS.get(pool, PROMPTS["en"])
+        model = options["model"] or config["language_model"]
+
+        generated = load_json(generated_file, {})
+        questions = generated.setdefault(pool, [])
+        known = {q.lower() for q in bank_config.get("pools", {}).get(pool, []) + questions}
+
+        added = 0
+        for _ in range(options["max_requests"]):
+            if added >= options["count"]:
+                break
+            response = ollama.chat(model=model, messages=[
+                {"role": "user", "content": prompt.format(count=options["batch"])}
+            ])
+            for line in response.get("message", {}).get("content", "").splitlines():
+                question = clean_question(line)
+                if not question.endswith("?") or question.lower() in known:
+                    continue
+                known.add(question.lower())
+                questions.append(question)
+                added += 1
+                if added >= options["count"]:
+                    break
+
+        atomic_write_json(generated_file, generated)
+        self.stdout.write(self.style.SUCCESS(f"✅ Додано питань до пулу {pool}: {added} (усього згенерованих: {len(questions)})"))
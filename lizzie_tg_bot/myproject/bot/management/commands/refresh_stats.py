@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from bot import analytics
+
+
+class Command(BaseCommand):
+    help = "Оновлює агрегати статистики з нових рядків chat_history (для cron або окремого процесу)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Оновлювати постійно з інтервалом")
+        parser.add_argument("--interval", type=int, default=60, help="Інтервал оновлення в секундах")
+        parser.add_argument("--rebuild", action="store_true", help="Перерахувати агрегати з нуля (після migrate_history)")
+
+    def handle(self, *args, **options):
+        rebuild = options["rebuild"]
+        while True:
+            analytics.refresh_all(rebuild)
+            rebuild = False
+            self.stdout.write(self.style.SUCCESS("✅ Статистику оновлено"))
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
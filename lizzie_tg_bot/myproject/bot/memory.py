@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import zlib
+import asyncio
+import logging
+import threading
+import functools
+import contextlib
+import collections
+from urllib.parse import quote
+import numpy as np
+import ollama
+from bot.lifecycle import atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+# Каталог з векторними індексами користувачів
+MEMORY_DIR = "memory"
+HASH_DIM = 256
+INITIAL_CAPACITY = 1024
+# Кожен відкритий індекс тримає два дескриптори файлів (memmap), тож кеш обмежений
+MAX_OPEN_INDEXES = 128
+
+
+# Локальна заміна моделі ембедингів: хешування слів і біграм у вектор фіксованої довжини
+def hash_embedding(text, dim=HASH_DIM):
+    vector = np.zeros(dim, dtype=np.float32)
+    words = re.findall(r"\w+", text.lower())
+    for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        h = zlib.crc32(token.encode("utf-8"))
+        vector[h % dim] += -1.0 if h & 0x80000000 else 1.0
+    return vector
+
+
+# Обчислення ембедингу через Ollama або локальну заміну
+@functools.lru_cache(maxsize=1024)
+def embed(text, model=None):
+    if model:
+        response = ollama.embeddings(model=model, prompt=text)
+        vector = np.asarray(response["embedding"], dtype=np.float32)
+    else:
+        vector = hash_embedding(text)
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """Векторний індекс реплік одного користувача, відображений у пам'ять.
+
+    Вектори нормалізовані і зберігаються у файлі float32 фіксованої ширини,
+    тексти — у JSONL з таблицею зсувів. Пошук — косинусна подібність
+    одним матрично-векторним добутком по всіх рядках.
+    """
+
+    def __init__(self, path, dim=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta_file = os.path.join(path, "meta.json")
+        self.vectors_file = os.path.join(path, "vectors.f32")
+        self.offsets_file = os.path.join(path, "offsets.i64")
+        self.texts_file = os.path.join(path, "texts.jsonl")
+
+        meta = load_json(self.meta_file, {})
+        self.dim = meta.get("dim", dim)
+        self.count = meta.get("count", 0)
+        self.capacity = meta.get("capacity", 0)
+        self.vectors = None
+        self.offsets = None
+        self.users = 0
+        self._lock = threading.Lock()
+        if self.capacity:
+            self._map()
+
+    def _map(self):
+        self.vectors = np.memmap(self.vectors_file, dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self.offsets = np.memmap(self.offsets_file, dtype=np.int64, mode="r+", shape=(self.capacity,))
+
+    # Збільшення файлів удвічі, коли місце закінчилося
+    def _grow(self):
+        if self.vectors is not None:
+            self.flush()
+        self.capacity = max(INITIAL_CAPACITY, self.capacity * 2)
+        for file_path, row_size in ((self.vectors_file, self.dim * 4), (self.offsets_file, 8)):
+            with open(file_path, "ab") as file:
+                file.truncate(self.capacity * row_size)
+        self._map()
+
+    def add(self, vector, record):
+        with self._lock:
+            self._add(vector, record)
+
+    def _add(self, vector, record):
+        if self.dim is None:
+            self.dim = len(vector)
+        if len(vector) != self.dim:
+            raise ValueError(f"Розмірність вектора {len(vector)} не збігається з індексом ({self.dim})")
+        if self.count == self.capacity:
+            self._grow()
+
+        with open(self.texts_file, "ab") as file:
+            offset = file.tell()
+            file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        self.vectors[self.count] = vector
+        self.offsets[self.count] = offset
+        self.count += 1
+        atomic_write_json(self.meta_file, {"dim": self.dim, "count": self.count, "capacity": self.capacity})
+
+    # Пошук top-k найближчих реплік за косинусною подібністю
+    def search(self, vector, top_k=3, min_score=0.0):
+        with self._lock:
+            return self._search(vector, top_k, min_score)
+
+    def _search(self, vector, top_k, min_score):
+        if not self.count or len(vector) != self.dim:
+            return []
+
+        scores = self.vectors[:self.count] @ vector
+        if top_k < self.count:
+            best = np.argpartition(scores, -top_k)[-top_k:]
+        else:
+            best = np.arange(self.count)
+        best = best[np.argsort(scores[best])[::-1]]
+
+        results = []
+        with open(self.texts_file, "rb") as file:
+            for row in best:
+                if scores[row] < min_score:
+                    break
+                file.seek(int(self.offsets[row]))
+                results.append((float(scores[row]), json.loads(file.readline())))
+        return results
+
+    def flush(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.offsets.flush()
+
+    # Закриття memmap-ів (звільняє дескриптори файлів)
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.vectors = None
+            self.offsets = None
+
+
+# Каталог індексу користувача: ключ "<персона>:<chat_id>" містить «:», недопустиму в шляхах Windows,
+# тож такі символи кодуються (звичайні chat_id лишаються без змін)
+def index_path(user_id):
+    return os.path.join(MEMORY_DIR, quote(str(user_id), safe="-_."))
+
+
+# LRU-кеш відкритих індексів користувачів; створення й витіснення — під спільним блокуванням
+indexes = collections.OrderedDict()
+indexes_lock = threading.Lock()
+
+
+# Індекс користувача, захищений від витіснення на час використання
+@contextlib.contextmanager
+def open_index(user_id):
+    with indexes_lock:
+        index = indexes.pop(user_id, None)
+        if index is None:
+            index = VectorIndex(index_path(user_id))
+        indexes[user_id] = index
+        index.users += 1
+        _evict()
+    try:
+        yield index
+    finally:
+        with indexes_lock:
+            index.users -= 1
+
+
+# Закриття найдавніше використаних індексів понад MAX_OPEN_INDEXES
+def _evict():
+    for user_id in list(indexes):
+        if len(indexes) <= MAX_OPEN_INDEXES:
+            break
+        index = indexes[user_id]
+        if not index.users:
+            del indexes[user_id]
+            index.close()
+
+
+# Скидання всіх індексів на диск (викликається під час зупинки бота)
+def flush_all():
+    with indexes_lock:
+        for index in indexes.values():
+            index.flush()
+
+
+# Пошук релевантних спогадів для повідомлення користувача
+async def recall(user_id, text, settings):
+    def _search():
+        vector = embed(text, settings.get("embedding_model"))
+        with open_index(user_id) as index:
+            return index.search(vector, settings.get("top_k", 3), settings.get("min_score", 0.0))
+
+    try:
+        return [record for _, record in await asyncio.to_thread(_search)]
+    except Exception as e:
+        logger.error(f"❌ Помилка пошуку в пам'яті: {e}")
+        return []
+
+
+# Збереження обміну репліками в довготривалу пам'ять
+async def remember(user_id, user_text, bot_text, settings):
+    def _add():
+        vector = embed(user_text, settings.get("embedding_model"))
+        with open_index(user_id) as index:
+            index.add(vector, {"user": user_text, "assistant": bot_text})
+
+    try:
+        await asyncio.to_thread(_add)
+    except Exception as e:
+        logger.error(f"❌ Помилка збереження в пам'ять: {e}")
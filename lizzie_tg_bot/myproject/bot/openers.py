@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import collections
+import psycopg2.extras
+from bot import llm
+from bot.db import connect_db, release_db
+from bot.prompts import build_reply_messages
+
+logger = logging.getLogger(__name__)
+
+# «Відкривачі» — короткі повідомлення з початку розмови: перші OPENER_TURNS повідомлень користувача.
+# Далі відповідь залежить від контексту («так», «ок», «дякую»), і готова відповідь без історії не підходить
+OPENER_MAX_LENGTH = 40
+OPENER_TURNS = 3
+DEFAULT_LANGUAGE = "українська"
+
+# Ключі (персона, мова, повідомлення), для яких є готові відповіді: інші повідомлення
+# не потребують звернення до бази. Оновлюється фоновою задачею
+available = set()
+
+
+# Нормалізація повідомлення: нижній регістр, без розділових знаків і емодзі, одинарні пробіли
+def normalize(text):
+    cleaned = "".join(ch for ch in text.lower() if ch.isalnum() or ch.isspace())
+    return " ".join(cleaned.split())
+
+
+def create_opener_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS opener_stats (
+            language TEXT NOT NULL,
+            message TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (language, message)
+        );
+        CREATE TABLE IF NOT EXISTS precomputed_replies (
+            id SERIAL PRIMARY KEY,
+            persona TEXT NOT NULL,
+            language TEXT NOT NULL,
+            message TEXT NOT NULL,
+            reply TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS precomputed_replies_lookup ON precomputed_replies (persona, language, message);
+    """)
+
+
+# Чи може повідомлення отримати готову відповідь: коротке і з початку розмови
+def is_opener(turns, text):
+    user_turns = sum(1 for turn in turns if turn["role"] == "user")
+    return user_turns < OPENER_TURNS and len(text) <= OPENER_MAX_LENGTH
+
+
+# Частотний аналіз нових коротких повідомлень з початку розмов (викликається з інкрементального
+# оновлення статистики). Місце повідомлення в розмові рахується за індексом (user_id, id)
+def rollup_openers(cursor, low, high):
+    cursor.execute("""
+        SELECT c.content, COALESCE(u.language, %(language)s)
+        FROM chat_history c LEFT JOIN users u ON u.user_id = c.user_id
+        WHERE c.id > %(low)s AND c.id <= %(high)s AND c.role = 'user' AND length(c.content) <= %(length)s
+          AND (
+              SELECT count(*) FROM (
+                  SELECT 1 FROM chat_history p
+                  WHERE p.user_id = c.user_id AND p.role = 'user' AND p.id < c.id
+                  LIMIT %(turns)s
+              ) AS earlier
+          ) < %(turns)s;
+    """, {"language": DEFAULT_LANGUAGE, "low": low, "high": high, "length": OPENER_MAX_LENGTH, "turns": OPENER_TURNS})
+    counts = collections.Counter()
+    for content, language in cursor:
+        message = normalize(content)
+        if message:
+            counts[(language, message)] += 1
+    if counts:
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO opener_stats (language, message, count) VALUES %s
+            ON CONFLICT (language, message) DO UPDATE SET count = opener_stats.count + EXCLUDED.count;
+        """, [(language, message, count) for (language, message), count in counts.items()])
+
+
+# Видача готової відповіді: кожна відповідь використовується лише раз
+def take_reply(persona, language, text):
+    key = (persona, language or DEFAULT_LANGUAGE, normalize(text))
+    if len(text) > OPENER_MAX_LENGTH or key not in available:
+        return None
+    conn = connect_db()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM precomputed_replies WHERE id = (
+                    SELECT id FROM precomputed_replies
+                    WHERE persona = %s AND language = %s AND message = %s
+                    ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                ) RETURNING reply;
+            """, key)
+            result = cursor.fetchone()
+            conn.commit()
+    finally:
+        release_db(conn)
+    if not result:
+        available.discard(key)
+    return result[0] if result else None
+
+
+# Оновлення множини ключів із готовими відповідями
+def refresh_available():
+    conn = connect_db()
+    if not conn:
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT persona, language, message FROM precomputed_replies;")
+            keys = set(cursor.fetchall())
+    finally:
+        release_db(conn)
+    available.clear()
+    available.update(keys)
+
+
+# Найчастіші відкривачі кожної мови, для яких у пулі бракує відповідей; старі відповіді ротуються
+def pool_deficits(persona, settings):
+    conn = connect_db()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM precomputed_replies WHERE persona = %s AND created_at < now() - make_interval(hours => %s);",
+                (persona, settings.get("max_age_hours", 24))
+            )
+            cursor.execute("""
+                SELECT s.language, s.message, %(pool_size)s - count(r.id)
+                FROM (
+                    SELECT language, message, count,
+                           row_number() OVER (PARTITION BY language ORDER BY count DESC) AS rank
+                    FROM opener_stats WHERE count >= %(min_count)s
+                ) AS s
+                LEFT JOIN precomputed_replies r
+                    ON r.persona = %(persona)s AND r.language = s.language AND r.message = s.message
+                WHERE s.rank <= %(top)s
+                GROUP BY s.language, s.message, s.count
+                HAVING count(r.id) < %(pool_size)s
+                ORDER BY s.count DESC;
+            """, {
+                "persona": persona, "pool_size": settings.get("pool_size", 5),
+                "min_count": settings.get("min_count", 3), "top": settings.get("top", 20),
+            })
+            deficits = cursor.fetchall()
+            conn.commit()
+    finally:
+        release_db(conn)
+    return deficits
+
+
+def store_reply(persona, language, message, reply):
+    conn = connect_db()
+    if not conn:
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO precomputed_replies (persona, language, message, reply) VALUES (%s, %s, %s, %s);",
+                (persona, language, message, reply)
+            )
+            conn.commit()
+    finally:
+        release_db(conn)
+    available.add((persona, language, message))
+
+
+# Поповнення пулів однієї персони, поки модель простоює; живий запит перериває генерацію
+async def precompute(persona, settings, skip=lambda message: False):
+    generated = 0
+    for language, message, missing in await asyncio.to_thread(pool_deficits, persona["name"], settings):
+        if skip(message):
+            continue
+        for _ in range(missing):
+            prompt_messages = build_reply_messages(message, (), persona["system_prompt"])
+            reply = await llm.background_chat(persona["language_model"], prompt_messages)
+            if reply is None:
+                return generated
+            reply = reply.strip()
+            if reply:
+                await asyncio.to_thread(store_reply, persona["name"], language, message, reply)
+                generated += 1
+    return generated
+
+
+# Фонове поповнення пулів готових відповідей для всіх персон
+async def precompute_periodically(personas, settings, skip=lambda message: False):
+    while True:
+        try:
+            await asyncio.to_thread(refresh_available)
+        except Exception as e:
+            logger.error(f"❌ Помилка читання готових відповідей: {e}")
+        await asyncio.sleep(settings.get("interval", 60))
+        for persona in personas:
+            try:
+                generated = await precompute(persona, settings, skip)
+                if generated:
+                    logger.info(f"🧊 [{persona['name']}] Підготовлено відповідей для частих повідомлень: {generated}")
+            except Exception as e:
+                logger.error(f"❌ Помилка підготовки відповідей: {e}")
@@ -0,0 +1,36 @@
+# Системні промпти Ліззі
+SYSTEM_PROMPT = "Говори коротко, вільно та невимушено. Не вважай себе штучним інтелектом, а справжньою людиною."
+FOLLOW_UP_PROMPT = "На основі цієї розмови, придумай коротке запитання, щоб підтримати діалог. Напиши лише запитання."
+
+
+# Промпти персони з її запису в config.json (спільно для бота і пакетної генерації)
+def persona_prompts(persona):
+    return persona.get("system_prompt", SYSTEM_PROMPT), persona.get("follow_up_prompt", FOLLOW_UP_PROMPT)
+
+
+# Функція формування блоку спогадів для системного промпту
+def format_memories(memories):
+    lines = [f"- {item['user']} → {item['assistant']}" for item in memories]
+    return "Що ти пам'ятаєш з попередніх розмов з цією людиною:\n" + "\n".join(lines)
+
+
+# Функція побудови повідомлень для відповіді (спільна для бота і пакетної генерації).
+# Порядок фіксований: незмінний системний промпт, далі історія розмови, яка між ходами лише
+# дописується, і тільки потім змінні спогади та нове повідомлення — так Ollama повторно
+# використовує KV-кеш для всього префікса розмови.
+def build_reply_messages(user_text, memories=(), system_prompt=SYSTEM_PROMPT, history=()):
+    prompt_messages = [{"role": "system", "content": system_prompt}]
+    prompt_messages.extend(history)
+    if memories:
+        prompt_messages.append({"role": "system", "content": format_memories(memories)})
+    prompt_messages.append({"role": "user", "content": user_text})
+    return prompt_messages
+
+
+# Функція побудови повідомлень для уточнювального запитання: лише дописує до запиту відповіді,
+# тож увесь префікс (системний промпт, спогади, повідомлення користувача) вже є в KV-кеші
+def build_follow_up_messages(reply_messages, reply, follow_up_prompt=FOLLOW_UP_PROMPT):
+    return reply_messages + [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": follow_up_prompt}
+    ]
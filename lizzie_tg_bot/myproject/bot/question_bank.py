@@ -0,0 +1,109 @@
+import math
+import random
+import asyncio
+import logging
+import threading
+from bot.lifecycle import atomic_write_json, load_json
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 30
+
+
+class QuestionBank:
+    """Банк уточнювальних питань без повторів для кожного користувача.
+
+    Для кожного пулу питань один раз будується спільна перестановка.
+    Користувач зберігає лише курсор (розмір пулу, a, b, позиція): його
+    чергове питання — permutation[(a * i + b) % n], де a взаємно просте з n,
+    тож за n кроків він отримує всі питання пулу рівно по одному разу.
+    Курсори незмінні (кортежі), тож знімок для запису на диск — це лише
+    поверхнева копія словника, а сам запис іде у фоновому потоці.
+    Знімки нумеруються: запис, що запізнився, не перезапише новіший.
+    """
+
+    def __init__(self, pools, state_file="question_state.json"):
+        self.state_file = state_file
+        self.pools = {}
+        self.permutations = {}
+        for name, questions in pools.items():
+            self.set_pool(name, questions)
+        self.cursors = self._load()
+        self.dirty = False
+        self._version = 0
+        self._written = 0
+        self._write_lock = threading.Lock()
+
+    def _load(self):
+        return {key: tuple(cursor) for key, cursor in load_json(self.state_file, {}).items()}
+
+    # Заміна або поповнення пулу питань (перестановка фіксована для назви пулу)
+    def set_pool(self, name, questions):
+        questions = list(dict.fromkeys(questions))
+        permutation = list(range(len(questions)))
+        random.Random(name).shuffle(permutation)
+        self.pools[name] = questions
+        self.permutations[name] = permutation
+
+    def _new_cursor(self, name):
+        n = len(self.pools[name])
+        a = random.choice([step for step in range(1, n + 1) if math.gcd(step, n) == 1])
+        return (name, n, a, random.randrange(n), 0)
+
+    # Наступне питання для користувача з пулу name
+    def next_question(self, user_id, name):
+        if not self.pools.get(name):
+            return ""
+
+        key = str(user_id)
+        cursor = self.cursors.get(key)
+        n = len(self.pools[name])
+        # Новий цикл, якщо пул змінився або всі питання вже задані
+        if not cursor or cursor[0] != name or cursor[1] != n or cursor[4] >= n:
+            cursor = self._new_cursor(name)
+
+        _, _, a, b, position = cursor
+        self.cursors[key] = (name, n, a, b, position + 1)
+        self.dirty = True
+
+        return self.pools[name][self.permutations[name][(a * position + b) % n]]
+
+    # Скидання курсора (наприклад, після зміни статі чи мови)
+    def reset(self, user_id):
+        if self.cursors.pop(str(user_id), None) is not None:
+            self.dirty = True
+
+    # Знімок курсорів для запису (None, якщо змін не було)
+    def snapshot(self):
+        if not self.dirty:
+            return None
+        self.dirty = False
+        self._version += 1
+        return self._version, dict(self.cursors)
+
+    def write(self, snapshot):
+        version, cursors = snapshot
+        with self._write_lock:
+            if version <= self._written:
+                return
+            atomic_write_json(self.state_file, cursors, indent=None, separators=(",", ":"))
+            self._written = version
+
+    # Синхронне збереження (під час зупинки бота — з потоку, не з циклу подій)
+    def flush(self):
+        snapshot = self.snapshot()
+        if snapshot is not None:
+            self.write(snapshot)
+
+    # Фонове збереження: знімок у циклі подій, запис на диск у потоці
+    async def flush_periodically(self, interval=FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            snapshot = self.snapshot()
+            if snapshot is None:
+                continue
+            try:
+                await asyncio.to_thread(self.write, snapshot)
+            except Exception as e:
+                self.dirty = True
+                logger.error(f"❌ Помилка збереження курсорів питань: {e}")
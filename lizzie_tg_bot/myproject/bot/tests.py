@@ -1,3 +1,401 @@
-from django.test import TestCase
+import io
+import os
+import json
+import asyncio
+import tempfile
+import threading
+import contextlib
+import importlib
+from types import SimpleNamespace
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from unittest import mock
+from bot import memory
+from bot import history_io
+from bot import lifecycle
+from bot import llm
+from bot import watchdog
+from bot import openers
+from bot.management.commands import batch_generate
+from bot.lifecycle import UpdateTracker, load_json
+from bot.question_bank import QuestionBank
 
-# Create your tests here.
+
+# bot_handler читає config.json і DATABASE_URL під час імпорту (логування лишаємо тестам)
+def import_bot_handler():
+    with tempfile.TemporaryDirectory() as directory, contextlib.chdir(directory):
+        with open("config.json", "w", encoding="utf-8") as file:
+            json.dump({"bot_name": "Ліззі", "language_model": "test"}, file)
+        with mock.patch.dict(os.environ, {"DATABASE_URL": "postgresql://test@localhost/test"}), mock.patch("logging.basicConfig"):
+            return importlib.import_module("bot.bot_handler")
+
+
+class UpdateTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.directory.name, "bot_state.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_duplicate_update_is_skipped(self):
+        tracker = UpdateTracker(self.state_file)
+        await tracker.begin(Update(update_id=10), None)
+        with self.assertRaises(ApplicationHandlerStop):
+            await tracker.begin(Update(update_id=10), None)
+        await tracker.finish(Update(update_id=10), None)
+        with self.assertRaises(ApplicationHandlerStop):
+            await tracker.begin(Update(update_id=10), None)
+
+    async def test_finished_updates_survive_restart(self):
+        tracker = UpdateTracker(self.state_file)
+        await tracker.begin(Update(update_id=10), None)
+        await tracker.finish(Update(update_id=10), None)
+        await tracker.flush()
+
+        restarted = UpdateTracker(self.state_file)
+        self.assertEqual(restarted.last_update_id, 10)
+        with self.assertRaises(ApplicationHandlerStop):
+            await restarted.begin(Update(update_id=10), None)
+
+    async def test_sequence_reset_is_not_dropped(self):
+        tracker = UpdateTracker(self.state_file)
+        await tracker.begin(Update(update_id=900000), None)
+        await tracker.finish(Update(update_id=900000), None)
+        # Після тижня тиші Telegram може почати нумерацію з меншого числа
+        await tracker.begin(Update(update_id=1234), None)
+        await tracker.finish(Update(update_id=1234), None)
+        self.assertEqual(tracker.last_update_id, 1234)
+
+    async def test_state_is_persisted_in_batches(self):
+        tracker = UpdateTracker(self.state_file, persist_interval=0.05)
+        for update_id in range(1, 6):
+            await tracker.begin(Update(update_id=update_id), None)
+        self.assertFalse(os.path.exists(self.state_file))
+        await asyncio.sleep(0.2)
+        self.assertEqual(sorted(load_json(self.state_file, {})["in_flight"]), ["1", "2", "3", "4", "5"])
+
+    async def test_in_flight_updates_are_replayed(self):
+        tracker = UpdateTracker(self.state_file)
+        await tracker.begin(Update(update_id=7), None)
+        await tracker.begin(Update(update_id=8), None)
+        await tracker.finish(Update(update_id=8), None)
+        await tracker.flush()
+
+        application = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+        await UpdateTracker(self.state_file).replay(application)
+        self.assertEqual(application.update_queue.qsize(), 1)
+        self.assertEqual(application.update_queue.get_nowait().update_id, 7)
+
+    async def test_flush_is_not_overwritten_by_background_write(self):
+        write = lifecycle.atomic_write_json
+        started = threading.Event()
+
+        # Перший фоновий запис зависає в потоці, поки зупинка вже пише фінальний стан
+        def slow_write(path, data):
+            if not started.is_set():
+                started.set()
+                threading.Event().wait(0.2)
+            write(path, data)
+
+        tracker = UpdateTracker(self.state_file, persist_interval=0)
+        with mock.patch.object(lifecycle, "atomic_write_json", slow_write):
+            await tracker.begin(Update(update_id=5), None)
+            await asyncio.to_thread(started.wait)
+            await tracker.finish(Update(update_id=5), None)
+            await tracker.flush()
+            await asyncio.sleep(0.3)
+        self.assertEqual(load_json(self.state_file, {})["in_flight"], {})
+
+
+class MemoryIndexCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.multiple(memory, MEMORY_DIR=self.directory.name, MAX_OPEN_INDEXES=2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(memory.indexes.clear)
+        memory.indexes.clear()
+
+    def test_least_recently_used_index_is_closed(self):
+        for user_id in ("1", "2", "3"):
+            with memory.open_index(user_id) as index:
+                index.add(memory.hash_embedding(f"повідомлення {user_id}"), {"user": user_id})
+        self.assertEqual(list(memory.indexes), ["2", "3"])
+
+        with memory.open_index("1") as index:
+            self.assertEqual(index.count, 1)
+            self.assertEqual(index.search(memory.embed("повідомлення 1"), top_k=1)[0][1], {"user": "1"})
+
+    def test_index_in_use_is_not_evicted(self):
+        with memory.open_index("1") as first:
+            for user_id in ("2", "3", "4"):
+                with memory.open_index(user_id):
+                    pass
+            self.assertIn("1", memory.indexes)
+            self.assertIs(memory.indexes["1"], first)
+
+
+class JsonStreamTests(SimpleTestCase):
+    history = {
+        "1": {"language": "uk", "context": [{"role": "user", "content": "привіт {\"лапки\"}, \\ кінець"}]},
+        "22": {"language": "en", "context": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello, world"}]},
+        "333": {"language": "uk", "context": []},
+    }
+
+    def write_history(self, text):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "chat_history.json")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    def test_values_split_across_chunk_boundaries(self):
+        text = json.dumps(self.history, ensure_ascii=False, indent=4)
+        # Кожен розмір частини ріже значення в іншому місці, зокрема посеред рядків і чисел
+        for chunk_size in range(1, 40):
+            stream = history_io._JsonStream(io.StringIO(text), chunk_size)
+            stream.expect("{")
+            users = {}
+            while True:
+                user_id = stream.decode()
+                stream.expect(":")
+                users[user_id] = stream.decode()
+                if stream.peek() == ",":
+                    stream.pos += 1
+                    continue
+                stream.expect("}")
+                break
+            self.assertEqual(users, self.history, chunk_size)
+
+    def test_iter_json(self):
+        path = self.write_history(json.dumps(self.history, ensure_ascii=False))
+        self.assertEqual(dict(history_io.iter_json(path)), self.history)
+
+    def test_iter_json_empty(self):
+        self.assertEqual(list(history_io.iter_json(self.write_history(""))), [])
+        self.assertEqual(list(history_io.iter_json(self.write_history(" { } "))), [])
+
+    def test_iter_json_truncated_file(self):
+        path = self.write_history(json.dumps(self.history)[:-10])
+        with self.assertRaises(ValueError):
+            list(history_io.iter_json(path))
+
+
+class QuestionBankTests(SimpleTestCase):
+    pools = {"uk": [f"Питання {i}?" for i in range(7)], "en": [f"Question {i}?" for i in range(4)]}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, "question_state.json")
+
+    def test_every_question_once_per_cycle(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        for user_id in range(20):
+            for cycle in range(3):
+                questions = [bank.next_question(user_id, "uk") for _ in self.pools["uk"]]
+                self.assertCountEqual(questions, self.pools["uk"], (user_id, cycle))
+
+    def test_reset_and_pool_change_start_new_cycle(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        bank.next_question(1, "uk")
+        bank.reset(1)
+        self.assertCountEqual([bank.next_question(1, "uk") for _ in self.pools["uk"]], self.pools["uk"])
+
+        bank.next_question(2, "uk")
+        self.assertCountEqual([bank.next_question(2, "en") for _ in self.pools["en"]], self.pools["en"])
+
+        bank.next_question(3, "uk")
+        bank.set_pool("uk", self.pools["uk"] + ["Нове питання?"])
+        self.assertCountEqual([bank.next_question(3, "uk") for _ in range(8)], self.pools["uk"] + ["Нове питання?"])
+
+    def test_unknown_pool(self):
+        self.assertEqual(QuestionBank(self.pools, self.state_file).next_question(1, "de"), "")
+
+    def test_cursor_survives_restart(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        asked = [bank.next_question(1, "uk") for _ in range(3)]
+        bank.flush()
+        restarted = QuestionBank(self.pools, self.state_file)
+        rest = [restarted.next_question(1, "uk") for _ in range(4)]
+        self.assertCountEqual(asked + rest, self.pools["uk"])
+
+    def test_late_write_does_not_overwrite_newer_snapshot(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        bank.next_question(1, "uk")
+        older = bank.snapshot()
+        bank.next_question(2, "uk")
+        bank.flush()
+        bank.write(older)
+        self.assertIn("2", QuestionBank(self.pools, self.state_file).cursors)
+
+    async def test_snapshot_is_written_in_background(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        bank.next_question(1, "uk")
+        task = asyncio.create_task(bank.flush_periodically(interval=0.01))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        self.assertFalse(bank.dirty)
+        self.assertIn("1", QuestionBank(self.pools, self.state_file).cursors)
+
+
+class HandleMessageTests(SimpleTestCase):
+    def setUp(self):
+        self.bot_handler = import_bot_handler()
+        self.memory = mock.AsyncMock(recall=mock.AsyncMock(return_value=[]))
+        for patcher in (
+            mock.patch.object(self.bot_handler, "MEMORY_CONFIG", {"enabled": True}),
+            mock.patch.object(self.bot_handler, "OPENERS_CONFIG", {}),
+            mock.patch.object(self.bot_handler, "memory", self.memory),
+            mock.patch.object(self.bot_handler, "save_message"),
+            mock.patch.object(self.bot_handler, "get_recent_messages", return_value=[]),
+            mock.patch.object(self.bot_handler.random, "random", return_value=1.0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def send(self, text, chat_id=1):
+        update = SimpleNamespace(message=SimpleNamespace(text=text, chat_id=chat_id, reply_text=mock.AsyncMock()))
+        persona = {"name": "lizzie", "key_prefix": "", "language_model": "test", "system_prompt": "", "llm_slots": asyncio.Semaphore(1)}
+        context = SimpleNamespace(bot_data={"persona": persona})
+        await self.bot_handler.handle_message(update, context)
+        return update.message.reply_text.await_args.args[0]
+
+    async def test_successful_reply_is_remembered(self):
+        with mock.patch.object(self.bot_handler.llm, "chat", mock.AsyncMock(return_value={"message": {"content": " Розкажу! "}})):
+            self.assertEqual(await self.send("розкажи щось"), "Розкажу!")
+        self.memory.remember.assert_awaited_once_with("1", "розкажи щось", "Розкажу!", {"enabled": True})
+
+    async def test_llm_failure_is_not_remembered(self):
+        with mock.patch.object(self.bot_handler.llm, "chat", mock.AsyncMock(side_effect=ConnectionError("ollama down"))):
+            self.assertEqual(await self.send("розкажи щось"), self.bot_handler.FALLBACK_RESPONSE)
+        self.memory.remember.assert_not_awaited()
+
+    async def test_opener_reply_only_at_start_of_conversation(self):
+        earlier = [{"role": role, "content": "ок"} for _ in range(openers.OPENER_TURNS) for role in ("user", "assistant")]
+        take_reply = mock.Mock(return_value="Готова відповідь")
+        chat = mock.AsyncMock(return_value={"message": {"content": "Відповідь з контекстом"}})
+        with mock.patch.object(self.bot_handler, "OPENERS_CONFIG", {"enabled": True}), \
+                mock.patch.object(self.bot_handler.openers, "take_reply", take_reply), \
+                mock.patch.object(self.bot_handler, "get_user_language", return_value="українська"), \
+                mock.patch.object(self.bot_handler.llm, "chat", chat):
+            self.assertEqual(await self.send("дякую", chat_id=1), "Готова відповідь")
+            chat.assert_not_awaited()
+
+            with mock.patch.object(self.bot_handler, "get_recent_messages", return_value=earlier):
+                self.assertEqual(await self.send("дякую", chat_id=2), "Відповідь з контекстом")
+        take_reply.assert_called_once_with("lizzie", "українська", "дякую")
+
+
+class ShutdownTests(SimpleTestCase):
+    async def test_state_is_flushed_under_strict_watchdog(self):
+        bot_handler = import_bot_handler()
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(os, "fsync", os.fsync):
+            tracker = UpdateTracker(os.path.join(directory, "bot_state.json"))
+            await tracker.begin(Update(update_id=3), None)
+            await tracker.finish(Update(update_id=3), None)
+            bank = QuestionBank({"uk": ["Питання?"]}, os.path.join(directory, "question_state.json"))
+            bank.next_question(1, "uk")
+            app = SimpleNamespace(
+                updater=SimpleNamespace(running=False), running=False,
+                bot_data={"tracker": tracker}, shutdown=mock.AsyncMock(),
+            )
+
+            # Суворий сторож кидає виняток на будь-який os.fsync у потоці циклу подій
+            loop_watchdog = watchdog.LoopWatchdog(strict=True)
+            loop_watchdog.guard(os, "fsync")
+            loop_watchdog.start()
+            try:
+                with mock.patch.object(bot_handler, "question_bank", bank):
+                    await bot_handler.shutdown([app])
+            finally:
+                loop_watchdog.stop()
+
+            self.assertEqual(UpdateTracker(tracker.state_file).last_update_id, 3)
+            self.assertIn("1", QuestionBank({"uk": ["Питання?"]}, bank.state_file).cursors)
+
+
+class BatchGenerateTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(llm.configure, llm.MAX_CONCURRENT)
+        chdir = contextlib.chdir(directory.name)
+        chdir.__enter__()
+        self.addCleanup(chdir.__exit__, None, None, None)
+        with open("config.json", "w", encoding="utf-8") as file:
+            json.dump({"language_model": "test", "llm": {"keep_alive": "5m"}}, file)
+        with open("prompts.jsonl", "w", encoding="utf-8") as file:
+            for text in ("привіт", "як справи?", "що нового?"):
+                file.write(json.dumps({"prompt": text}, ensure_ascii=False) + "\n")
+
+    def results(self):
+        with open("batch_results.jsonl", encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    def test_requests_use_configured_llm_path(self):
+        response = {"message": {"content": "Відповідь"}, "eval_count": 10, "eval_duration": 10 ** 9}
+        with mock.patch.object(llm.ollama, "chat", return_value=response) as chat:
+            call_command("batch_generate", "prompts.jsonl", stdout=io.StringIO())
+        self.assertEqual(chat.call_count, 3)
+        self.assertEqual({call.kwargs["keep_alive"] for call in chat.call_args_list}, {"5m"})
+        self.assertEqual(sorted(result["id"] for result in self.results()), ["1", "2", "3"])
+
+    def test_resume_skips_done_and_retries_errors_and_truncated_line(self):
+        with open("batch_results.jsonl", "w", encoding="utf-8") as file:
+            file.write(json.dumps({"id": "1", "model": "test", "response": "так"}) + "\n")
+            file.write(json.dumps({"id": "2", "model": "test", "error": "ConnectionError: down"}) + "\n")
+            file.write('{"id": "3", "model": "te')
+        self.assertEqual(batch_generate.read_done("batch_results.jsonl"), {("1", "test")})
+
+        with mock.patch.object(llm.ollama, "chat", return_value={"message": {"content": "Відповідь"}}) as chat:
+            call_command("batch_generate", "prompts.jsonl", stdout=io.StringIO())
+        self.assertEqual(sorted(call.kwargs["messages"][-1]["content"] for call in chat.call_args_list), ["що нового?", "як справи?"])
+        self.assertEqual(sorted(result["id"] for result in self.results()), ["1", "2", "2", "3"])
+
+    def test_truncate_partial_line(self):
+        for text, expected in (("", ""), ("ab", ""), ("a\n", "a\n"), ("a\nbb", "a\n"), ("a\nb\nccc", "a\nb\n")):
+            with open("batch_results.jsonl", "w", encoding="utf-8") as file:
+                file.write(text)
+            batch_generate.truncate_partial_line("batch_results.jsonl", chunk_size=2)
+            with open("batch_results.jsonl", encoding="utf-8") as file:
+                self.assertEqual(file.read(), expected, text)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(batch_generate.percentile(values, 0.5), 51)
+        self.assertEqual(batch_generate.percentile(values, 0.99), 100)
+        self.assertEqual(batch_generate.percentile([], 0.9), 0.0)
+
+
+class OpenerTests(SimpleTestCase):
+    def test_normalize(self):
+        self.assertEqual(openers.normalize("  Привіт!!  Як   справи? 😊"), "привіт як справи")
+        self.assertEqual(openers.normalize("🙂👍"), "")
+
+    def test_is_opener(self):
+        self.assertTrue(openers.is_opener([], "привіт"))
+        self.assertFalse(openers.is_opener([], "а" * (openers.OPENER_MAX_LENGTH + 1)))
+        turns = []
+        for _ in range(openers.OPENER_TURNS):
+            self.assertTrue(openers.is_opener(turns, "так"))
+            turns += [{"role": "user", "content": "так"}, {"role": "assistant", "content": "Чудово!"}]
+        self.assertFalse(openers.is_opener(turns, "так"))
+
+    async def test_precompute_skips_canned_messages(self):
+        bot_handler = import_bot_handler()
+        deficits = [("українська", "привіт", 2), ("українська", "як тебе звати", 1), ("українська", "що робиш", 2)]
+        persona = {"name": "lizzie", "system_prompt": "", "language_model": "test"}
+        background_chat = mock.AsyncMock(return_value=" Відпочиваю! ")
+        with mock.patch.object(openers, "pool_deficits", return_value=deficits), \
+                mock.patch.object(openers, "store_reply") as store_reply, \
+                mock.patch.object(openers.llm, "background_chat", background_chat):
+            generated = await openers.precompute(persona, {}, bot_handler.is_canned)
+        self.assertEqual(generated, 2)
+        self.assertEqual({call.args[1][-1]["content"] for call in background_chat.await_args_list}, {"що робиш"})
+        store_reply.assert_called_with("lizzie", "українська", "що робиш", "Відпочиваю!")
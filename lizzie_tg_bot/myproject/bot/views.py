@@ -1,3 +1,16 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
+from django.views.decorators.cache import cache_page
+from bot import analytics
 
-# Create your views here.
+
+# Дашборд статистики: читає лише попередньо обчислені агрегати, відповідь кешується на хвилину
+@staff_member_required
+@cache_page(60)
+def dashboard(request):
+    conn = analytics.connect()
+    try:
+        data = analytics.dashboard_data(conn)
+    finally:
+        conn.close()
+    return render(request, "bot/dashboard.html", data)
@@ -16,7 +16,9 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
+from bot import views
 
 urlpatterns = [
+    path('admin/stats/', views.dashboard, name='bot_dashboard'),
     path('admin/', admin.site.urls),
 ]
@@ -1,10 +1,16 @@
 import os
+import time
+import asyncio
 import logging
 import ollama
 import json
+import tempfile
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from bot import watchdog
+from bot.llm import log_eval_stats
+from bot.conversation import Conversation
 
 # Завантажуємо змінні середовища
 load_dotenv()
@@ -22,6 +28,8 @@ if os.path.exists(HISTORY_FILE) and os.path.getsize(HISTORY_FILE) > 0:
     try:
         with open(HISTORY_FILE, "r", encoding="utf-8") as file:
             chat_history = json.load(file)
+        for user_data in chat_history.values():
+            user_data["context"] = Conversation(user_data["context"])
     except json.JSONDecodeError:
         logger.error("❌ Помилка декодування JSON! Очищуємо файл...")
         chat_history = {}
@@ -29,10 +37,67 @@ else:
     chat_history = {}
 
 
-# Функція збереження історії
-def save_history():
-    with open(HISTORY_FILE, "w", encoding="utf-8") as file:
-        json.dump(chat_history, file, ensure_ascii=False, indent=4)
+# Запис знімка історії (атомарно: тимчасовий файл + rename); виконується у фоновому потоці.
+# Розмови пишуться по одній через Conversation.to_json(), без розбору стиснутих блоків
+def write_history(snapshot):
+    directory = os.path.dirname(os.path.abspath(HISTORY_FILE))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write("{")
+            for index, (user_id, user_data) in enumerate(snapshot.items()):
+                file.write(",\n" if index else "\n")
+                file.write(f'{json.dumps(user_id)}: {{"language": {json.dumps(user_data["language"])}, '
+                           f'"context": {user_data["context"].to_json()}}}')
+            file.write("\n}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, HISTORY_FILE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Знімок береться в циклі подій, тож потік запису не бачить змін, що відбуваються паралельно.
+# Копіюються лише розмови змінених користувачів, решта береться з попереднього знімка
+history_snapshot = {}
+dirty_users = set(chat_history)
+
+
+def snapshot_history():
+    for user_id in dirty_users:
+        user_data = chat_history[user_id]
+        history_snapshot[user_id] = {"language": user_data["language"], "context": user_data["context"].copy()}
+    dirty_users.clear()
+    return dict(history_snapshot)
+
+
+# Відкладене збереження: зміни за SAVE_DELAY секунд пишуться одним записом поза циклом подій
+SAVE_DELAY = 1.0
+history_dirty = False
+save_task = None
+
+
+def save_history(user_id):
+    global history_dirty, save_task
+    dirty_users.add(user_id)
+    history_dirty = True
+    if save_task is None or save_task.done():
+        save_task = asyncio.create_task(save_history_later())
+
+
+async def save_history_later():
+    global history_dirty
+    while history_dirty:
+        await asyncio.sleep(SAVE_DELAY)
+        history_dirty = False
+        try:
+            await asyncio.to_thread(write_history, snapshot_history())
+        except Exception as e:
+            history_dirty = True
+            logger.error(f"❌ Помилка збереження історії: {e}")
+            await asyncio.sleep(SAVE_DELAY)
 
 
 # Словники для збереження контексту користувача
@@ -66,8 +131,8 @@ async def set_language(update: Update, context: CallbackContext):
         await update.message.reply_text("Please choose either 'English' or 'Українська'.")
         return
 
-    chat_history[user_id] = {"language": user_languages[user_id], "context": []}
-    save_history()
+    chat_history[user_id] = {"language": user_languages[user_id], "context": Conversation()}
+    save_history(user_id)
     await update.message.reply_text(LANGUAGES[user_languages[user_id]])
 
 
@@ -75,18 +140,20 @@ async def set_language(update: Update, context: CallbackContext):
 async def get_gemma_response(user_id, user_message):
     try:
         if user_id not in chat_history:
-            chat_history[user_id] = {"language": "uk", "context": []}
+            chat_history[user_id] = {"language": "uk", "context": Conversation()}
 
-        chat_history[user_id]["context"].append({"role": "user", "content": user_message})
+        chat_history[user_id]["context"].append("user", user_message)
 
-        response = ollama.chat(
-            model="gemma:7b",
-            messages=chat_history[user_id]["context"]
+        # Розпакування історії — у потоці, над знімком розмови
+        conversation = chat_history[user_id]["context"].copy()
+        response = await asyncio.to_thread(
+            lambda: ollama.chat(model="gemma:7b", messages=conversation.to_messages(), keep_alive="30m")
         )
         bot_response = response["message"]["content"]
+        log_eval_stats(response)
 
-        chat_history[user_id]["context"].append({"role": "assistant", "content": bot_response})
-        save_history()
+        chat_history[user_id]["context"].append("assistant", bot_response)
+        save_history(user_id)
         return bot_response
     except Exception as e:
         logger.error(f"Помилка при зверненні до Ollama: {e}")
@@ -106,18 +173,43 @@ async def handle_message(update: Update, context: CallbackContext):
 async def restart(update: Update, context: CallbackContext):
     user_id = str(update.message.chat_id)
     if user_id in chat_history:
-        chat_history[user_id]["context"] = []
-        save_history()
+        chat_history[user_id]["context"].clear()
+        save_history(user_id)
     await update.message.reply_text("🔄 Розмова перезапущена! Ви можете почати з чистого листа.")
 
 
+# Сторож циклу подій (налаштовується через LOOP_WATCHDOG* у .env)
+loop_watchdog = watchdog.from_env()
+if loop_watchdog:
+    loop_watchdog.guard(ollama, "chat")
+    loop_watchdog.guard(time, "sleep")
+    loop_watchdog.guard(os, "fsync")
+
+
+# Запуск сторожа разом із циклом подій
+async def post_init(application: Application):
+    if loop_watchdog:
+        loop_watchdog.start()
+
+
+# Зупинка сторожа з фінальним звітом і збереження історії, що ще не записана
+async def post_shutdown(application: Application):
+    if loop_watchdog:
+        loop_watchdog.stop()
+    if save_task and not save_task.done():
+        try:
+            await asyncio.wait_for(save_task, timeout=30)
+        except asyncio.TimeoutError:
+            logger.error("❌ Не вдалося зберегти історію перед зупинкою")
+
+
 # Функція запуску бота
 def run_telegram_bot():
     if not TOKEN:
         logger.error("❌ TELEGRAM_BOT_TOKEN не знайдено!")
         return
 
-    app = Application.builder().token(TOKEN).build()
+    app = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setlanguage", set_language))
     app.add_handler(CommandHandler("restart", restart))
@@ -0,0 +1,115 @@
+import json
+import zlib
+import array
+
+# Таблиця ролей: у розмові зберігається лише однобайтовий код ролі
+ROLES = ["system", "user", "assistant", "tool"]
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+# Скільки останніх реплік тримати нестиснутими і скільки стискати одним блоком
+HOT_TURNS = 32
+BLOCK_SIZE = 32
+
+
+def role_code(role):
+    if role not in ROLE_CODES:
+        ROLE_CODES[role] = len(ROLES)
+        ROLES.append(role)
+    return ROLE_CODES[role]
+
+
+class Conversation:
+    """Компактна історія розмови замість списку словників {"role", "content"}.
+
+    Ролі зберігаються масивом байтів, тексти — списком рядків. Старі репліки
+    блоками по BLOCK_SIZE стискаються zlib уже у вигляді JSON-повідомлень,
+    тож to_json() для збереження лише розпаковує блоки, не розбираючи їх.
+    Список повідомлень для Ollama будується на вимогу через to_messages().
+    """
+
+    __slots__ = ("roles", "cold", "hot")
+
+    def __init__(self, messages=()):
+        self.roles = array.array("B")
+        self.cold = []
+        self.hot = []
+        for message in messages:
+            self.append(message["role"], message["content"])
+
+    def __len__(self):
+        return len(self.roles)
+
+    def append(self, role, content):
+        self.roles.append(role_code(role))
+        self.hot.append(content)
+        if len(self.hot) >= HOT_TURNS + BLOCK_SIZE:
+            start = len(self.roles) - len(self.hot)
+            block, self.hot = self.hot[:BLOCK_SIZE], self.hot[BLOCK_SIZE:]
+            messages = self._messages(self.roles[start:start + BLOCK_SIZE], block)
+            # Блок — JSON-масив повідомлень без дужок, щоб блоки можна було з'єднувати комами
+            self.cold.append(zlib.compress(json.dumps(messages, ensure_ascii=False)[1:-1].encode("utf-8")))
+
+    # Знімок для читання в іншому потоці: стиснуті блоки спільні, бо не змінюються
+    def copy(self):
+        snapshot = Conversation()
+        snapshot.roles = array.array("B", self.roles)
+        snapshot.cold = list(self.cold)
+        snapshot.hot = list(self.hot)
+        return snapshot
+
+    def clear(self):
+        self.roles = array.array("B")
+        self.cold = []
+        self.hot = []
+
+    @staticmethod
+    def _messages(roles, contents):
+        return [{"role": ROLES[code], "content": content} for code, content in zip(roles, contents)]
+
+    # Список повідомлень у форматі Ollama
+    def to_messages(self):
+        messages = []
+        for block in self.cold:
+            messages.extend(json.loads("[" + zlib.decompress(block).decode("utf-8") + "]"))
+        messages.extend(self._messages(self.roles[len(self.roles) - len(self.hot):], self.hot))
+        return messages
+
+    # JSON-масив повідомлень для збереження: стиснуті блоки лише розпаковуються
+    def to_json(self):
+        parts = [zlib.decompress(block).decode("utf-8") for block in self.cold]
+        if self.hot:
+            hot = self._messages(self.roles[len(self.roles) - len(self.hot):], self.hot)
+            parts.append(json.dumps(hot, ensure_ascii=False)[1:-1])
+        return "[" + ", ".join(parts) + "]"
+
+
+# Порівняння пам'яті: список словників проти Conversation (python -m bot.conversation)
+def benchmark(users=1000, turns=200):
+    import random
+    import tracemalloc
+
+    words = ["привіт", "як", "справи", "що", "робиш", "сьогодні", "кава", "фільм", "погода", "робота", "так", "ні"]
+
+    # Нові рядки для кожного користувача, як при отриманні повідомлень з Telegram
+    def dialog(user):
+        rng = random.Random(user)
+        for i in range(turns):
+            yield {"role": "user" if i % 2 == 0 else "assistant", "content": " ".join(rng.choices(words, k=rng.randint(3, 25)))}
+
+    def measure(build):
+        tracemalloc.start()
+        data = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del data
+        return size
+
+    as_dicts = measure(lambda: {user: list(dialog(user)) for user in range(users)})
+    as_conversations = measure(lambda: {user: Conversation(dialog(user)) for user in range(users)})
+    print(f"Користувачів: {users}, реплік на користувача: {turns}")
+    print(f"Список словників: {as_dicts / 2 ** 20:.1f} МБ")
+    print(f"Conversation:     {as_conversations / 2 ** 20:.1f} МБ ({as_dicts / as_conversations:.1f}× менше)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,10 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Журнал оцінки промпту і генерації з полів відповіді Ollama
+# (повторно використаний з KV-кешу префікс у prompt_eval_count не входить)
+def log_eval_stats(response):
+    logger.info(f"🧮 Оцінка промпту: {response.get('prompt_eval_count')} ток. за {(response.get('prompt_eval_duration') or 0) / 1e6:.0f} мс, "
+                f"генерація: {response.get('eval_count')} ток. за {(response.get('eval_duration') or 0) / 1e6:.0f} мс")
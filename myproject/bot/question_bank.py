@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import random
+import asyncio
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 30
+
+
+class QuestionBank:
+    """Банк уточнювальних питань без повторів для кожного користувача.
+
+    Для кожного пулу питань один раз будується спільна перестановка.
+    Користувач зберігає лише курсор (розмір пулу, a, b, позиція): його
+    чергове питання — permutation[(a * i + b) % n], де a взаємно просте з n,
+    тож за n кроків він отримує всі питання пулу рівно по одному разу.
+    Курсори незмінні (кортежі), тож знімок для запису на диск — це лише
+    поверхнева копія словника, а сам запис іде у фоновому потоці.
+    """
+
+    def __init__(self, pools, state_file="question_state.json"):
+        self.state_file = state_file
+        self.pools = {}
+        self.permutations = {}
+        for name, questions in pools.items():
+            self.set_pool(name, questions)
+        self.cursors = self._load()
+        self.dirty = False
+
+    def _load(self):
+        if not os.path.exists(self.state_file) or os.path.getsize(self.state_file) == 0:
+            return {}
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                return {key: tuple(cursor) for key, cursor in json.load(file).items()}
+        except json.JSONDecodeError:
+            logger.error(f"❌ Пошкоджений файл {self.state_file}, курсори питань скинуто")
+            return {}
+
+    # Заміна або поповнення пулу питань (перестановка фіксована для назви пулу)
+    def set_pool(self, name, questions):
+        questions = list(dict.fromkeys(questions))
+        permutation = list(range(len(questions)))
+        random.Random(name).shuffle(permutation)
+        self.pools[name] = questions
+        self.permutations[name] = permutation
+
+    def _new_cursor(self, name):
+        n = len(self.pools[name])
+        a = random.choice([step for step in range(1, n + 1) if math.gcd(step, n) == 1])
+        return (name, n, a, random.randrange(n), 0)
+
+    # Наступне питання для користувача з пулу name
+    def next_question(self, user_id, name):
+        if not self.pools.get(name):
+            return ""
+
+        key = str(user_id)
+        cursor = self.cursors.get(key)
+        n = len(self.pools[name])
+        # Новий цикл, якщо пул змінився або всі питання вже задані
+        if not cursor or cursor[0] != name or cursor[1] != n or cursor[4] >= n:
+            cursor = self._new_cursor(name)
+
+        _, _, a, b, position = cursor
+        self.cursors[key] = (name, n, a, b, position + 1)
+        self.dirty = True
+
+        return self.pools[name][self.permutations[name][(a * position + b) % n]]
+
+    # Скидання курсора (наприклад, після зміни статі чи мови)
+    def reset(self, user_id):
+        if self.cursors.pop(str(user_id), None) is not None:
+            self.dirty = True
+
+    # Знімок курсорів для запису (None, якщо змін не було)
+    def snapshot(self):
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return dict(self.cursors)
+
+    # Атомарний запис знімка: тимчасовий файл + rename
+    def write(self, cursors):
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(cursors, file, ensure_ascii=False, separators=(",", ":"))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.state_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # Синхронне збереження (під час зупинки бота)
+    def flush(self):
+        cursors = self.snapshot()
+        if cursors is not None:
+            self.write(cursors)
+
+    # Фонове збереження: знімок у циклі подій, запис на диск у потоці
+    async def flush_periodically(self, interval=FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            cursors = self.snapshot()
+            if cursors is None:
+                continue
+            try:
+                await asyncio.to_thread(self.write, cursors)
+            except Exception as e:
+                self.dirty = True
+                logger.error(f"❌ Помилка збереження курсорів питань: {e}")
@@ -1,3 +1,84 @@
-from django.test import TestCase
+import os
+import json
+import asyncio
+import tempfile
+from django.test import SimpleTestCase
+from bot.question_bank import QuestionBank
+from bot.conversation import Conversation, HOT_TURNS, BLOCK_SIZE
 
-# Create your tests here.
+
+class QuestionBankTests(SimpleTestCase):
+    pools = {"uk": [f"Питання {i}?" for i in range(7)], "en": [f"Question {i}?" for i in range(4)]}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, "question_state.json")
+
+    def test_every_question_once_per_cycle(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        for user_id in range(20):
+            for cycle in range(3):
+                questions = [bank.next_question(user_id, "uk") for _ in self.pools["uk"]]
+                self.assertCountEqual(questions, self.pools["uk"], (user_id, cycle))
+
+    def test_reset_and_pool_change_start_new_cycle(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        bank.next_question(1, "uk")
+        bank.reset(1)
+        self.assertCountEqual([bank.next_question(1, "uk") for _ in self.pools["uk"]], self.pools["uk"])
+
+        bank.next_question(2, "uk")
+        self.assertCountEqual([bank.next_question(2, "en") for _ in self.pools["en"]], self.pools["en"])
+
+        bank.next_question(3, "uk")
+        bank.set_pool("uk", self.pools["uk"] + ["Нове питання?"])
+        self.assertCountEqual([bank.next_question(3, "uk") for _ in range(8)], self.pools["uk"] + ["Нове питання?"])
+
+    def test_unknown_pool(self):
+        self.assertEqual(QuestionBank(self.pools, self.state_file).next_question(1, "de"), "")
+
+    def test_cursor_survives_restart(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        asked = [bank.next_question(1, "uk") for _ in range(3)]
+        bank.flush()
+        restarted = QuestionBank(self.pools, self.state_file)
+        rest = [restarted.next_question(1, "uk") for _ in range(4)]
+        self.assertCountEqual(asked + rest, self.pools["uk"])
+
+    async def test_snapshot_is_written_in_background(self):
+        bank = QuestionBank(self.pools, self.state_file)
+        bank.next_question(1, "uk")
+        task = asyncio.create_task(bank.flush_periodically(interval=0.01))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        self.assertFalse(bank.dirty)
+        self.assertIn("1", QuestionBank(self.pools, self.state_file).cursors)
+
+
+class ConversationTests(SimpleTestCase):
+    def dialog(self, turns):
+        roles = ["user", "assistant", "system", "tool"]
+        return [{"role": roles[i % 4], "content": f"репліка {i} \"лапки\", \\ і емодзі 😊"} for i in range(turns)]
+
+    def test_round_trip_through_compression(self):
+        for turns in (0, 1, HOT_TURNS + BLOCK_SIZE - 1, HOT_TURNS + BLOCK_SIZE, 5 * BLOCK_SIZE + 7):
+            messages = self.dialog(turns)
+            conversation = Conversation(messages)
+            self.assertEqual(len(conversation), turns)
+            self.assertEqual(conversation.to_messages(), messages, turns)
+            self.assertEqual(json.loads(conversation.to_json()), messages, turns)
+        self.assertTrue(conversation.cold)
+
+    def test_copy_is_independent_snapshot(self):
+        conversation = Conversation(self.dialog(HOT_TURNS + BLOCK_SIZE - 1))
+        snapshot = conversation.copy()
+        conversation.append("user", "нове")
+        self.assertEqual(snapshot.to_messages(), self.dialog(HOT_TURNS + BLOCK_SIZE - 1))
+        self.assertEqual(conversation.to_messages()[-1], {"role": "user", "content": "нове"})
+
+    def test_clear(self):
+        conversation = Conversation(self.dialog(3 * BLOCK_SIZE))
+        conversation.clear()
+        self.assertEqual(conversation.to_messages(), [])
+        self.assertEqual(conversation.to_json(), "[]")
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Корінь проєкту: місця виклику всередині нього вважаються «нашими»
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BlockingCallError(RuntimeError):
+    """Блокуючий виклик у циклі подій (лише в суворому режимі)."""
+
+
+# Місце виклику: найглибший кадр з коду проєкту, інакше найглибший взагалі
+def call_site(frame):
+    innermost = frame
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(PROJECT_DIR) and "site-packages" not in filename and filename != os.path.abspath(__file__):
+            return f"{os.path.relpath(filename, PROJECT_DIR)}:{frame.f_lineno} у {frame.f_code.co_name}"
+        frame = frame.f_back
+    if innermost is None:
+        return "невідомо"
+    return f"{innermost.f_code.co_filename}:{innermost.f_lineno} у {innermost.f_code.co_name}"
+
+
+class LoopWatchdog:
+    """Сторож циклу подій: вимірює затримку циклу і ловить блокуючі виклики.
+
+    Корутина-пульс кожні interval секунд оновлює мітку часу. Окремий потік
+    перевіряє мітку і, якщо цикл не відповідає довше за threshold, знімає
+    стек потоку циклу та записує місце виклику, що його заблокувало.
+    """
+
+    def __init__(self, interval=0.05, threshold=0.25, report_interval=300, strict=False):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.strict = strict
+        self.lags = collections.deque(maxlen=10000)
+        self.offenders = collections.Counter()
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self._reported_beat = None
+        self._warned_calls = set()
+        self._stop = threading.Event()
+        self._task = None
+        self._thread = None
+
+    # Запуск; викликати з потоку циклу подій
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Сторож циклу подій запущено (поріг {self.threshold * 1000:.0f} мс, суворий режим: {self.strict})")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+        self.report()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lags.append(max(0.0, now - expected))
+            self.last_beat = now
+
+    def _monitor(self):
+        last_report = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            beat = self.last_beat
+            blocked = now - beat
+            if blocked > self.threshold and self._reported_beat != beat:
+                self._reported_beat = beat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                site = call_site(frame)
+                self.offenders[site] += 1
+                stack = "".join(traceback.format_stack(frame)) if frame else ""
+                logger.warning(f"🐢 Цикл подій заблоковано вже {blocked * 1000:.0f} мс: {site}\n{stack}")
+            if now - last_report > self.report_interval:
+                last_report = now
+                self.report()
+
+    # Звіт: перцентилі затримки циклу та найчастіші місця блокування
+    def report(self):
+        if not self.lags:
+            return
+        lags = sorted(self.lags)
+        p50 = lags[len(lags) // 2] * 1000
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000
+        lines = [f"📈 Затримка циклу подій: p50 {p50:.1f} мс, p99 {p99:.1f} мс, max {lags[-1] * 1000:.1f} мс"]
+        for site, count in self.offenders.most_common(10):
+            lines.append(f"   {count}× {site}")
+        logger.info("\n".join(lines))
+
+    # Обгортка функції, яка не повинна викликатися в потоці циклу подій
+    def guard(self, module, name):
+        original = getattr(module, name)
+        qualified = f"{module.__name__}.{name}"
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() == self.loop_thread_id and not self._stop.is_set():
+                self._blocking_call(qualified)
+            return original(*args, **kwargs)
+
+        setattr(module, name, wrapper)
+
+    def _blocking_call(self, qualified):
+        site = call_site(sys._getframe(2))
+        if self.strict:
+            raise BlockingCallError(f"Блокуючий виклик {qualified} у циклі подій: {site}")
+        self.offenders[f"{qualified} ← {site}"] += 1
+        if (qualified, site) not in self._warned_calls:
+            self._warned_calls.add((qualified, site))
+            logger.warning(f"⚠️ Блокуючий виклик {qualified} у циклі подій: {site}")
+
+
+# Створення сторожа з налаштувань середовища (.env). Вмикається явно: LOOP_WATCHDOG=1
+# або LOOP_WATCHDOG_STRICT=1, бо обгортки підміняють функції (зокрема time.sleep) для всього процесу
+def from_env():
+    strict = os.getenv("LOOP_WATCHDOG_STRICT", "0") == "1"
+    if os.getenv("LOOP_WATCHDOG", "0") != "1" and not strict:
+        return None
+    return LoopWatchdog(
+        threshold=float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250")) / 1000,
+        strict=strict,
+    )
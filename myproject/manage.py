@@ -1,10 +1,16 @@
 import os
+import time
+import asyncio
 import logging
 import ollama
 import random
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from bot.question_bank import QuestionBank
+from bot import watchdog
+from bot.llm import log_eval_stats
+from bot.conversation import Conversation
 
 # Завантажуємо змінні середовища
 load_dotenv()
@@ -14,10 +20,9 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Словники для збереження контексту користувача
+# Словники для збереження контексту користувача (компактні Conversation замість списків словників)
 user_context = {}
 user_gender = {}  # Збереження статі співрозмовника
-user_questions = {}  # Збереження списку вже заданих питань
 
 # База питань для кожної статі
 QUESTION_SETS = {
@@ -40,25 +45,23 @@ QUESTION_SETS = {
 }
 
 
+# Банк питань: спільна перестановка на пул і компактний курсор на користувача
+question_bank = QuestionBank(QUESTION_SETS, "question_state.json")
+
+
 # Функція для отримання унікального питання
 def get_unique_question(user_id):
     gender = user_gender.get(user_id, "чоловік")
-
-    # Якщо користувач ще не отримував питань, ініціалізуємо йому список
-    if user_id not in user_questions or not user_questions[user_id]:
-        user_questions[user_id] = QUESTION_SETS[gender].copy()
-        random.shuffle(user_questions[user_id])  # Перемішуємо список питань
-
-    return user_questions[user_id].pop()  # Вибираємо питання та видаляємо його зі списку
+    return question_bank.next_question(user_id, gender)
 
 
 # Функція для отримання відповіді від Gemma через Ollama
 def get_gemma_response(user_id, user_message):
     try:
         if user_id not in user_context:
-            user_context[user_id] = [{"role": "system", "content": "Будь природною, живою, зберігай контекст розмови."}]
+            user_context[user_id] = Conversation([{"role": "system", "content": "Будь природною, живою, зберігай контекст розмови."}])
 
-        user_context[user_id].append({"role": "user", "content": user_message})
+        user_context[user_id].append("user", user_message)
 
         # Фіксовані відповіді
         user_message_lower = user_message.lower()
@@ -73,15 +76,18 @@ def get_gemma_response(user_id, user_message):
             age = random.randint(18, 25)
             return f"Мені {age} 😊"
 
-        response = ollama.chat(model="gemma:7b", messages=user_context[user_id])
+        response = ollama.chat(model="gemma:7b", messages=user_context[user_id].to_messages(), keep_alive="30m")
         bot_response = response["message"]["content"]
+        log_eval_stats(response)
+
+        # В історію йде повна відповідь: вона збігається з KV-кешем Ollama, тож наступний запит
+        # повторно використовує весь префікс розмови
+        user_context[user_id].append("assistant", bot_response)
 
-        # Обмеження довжини відповіді
+        # Обмеження довжини відповіді (лише для користувача)
         if len(bot_response) > 100:
             bot_response = bot_response[:100] + "..."
 
-        user_context[user_id].append({"role": "assistant", "content": bot_response})
-
         return bot_response
     except Exception as e:
         logger.error(f"Помилка при зверненні до Ollama: {e}")
@@ -103,7 +109,7 @@ async def set_gender(update: Update, context: CallbackContext):
     gender = context.args[0].lower()
     if gender in ["чоловік", "жінка"]:
         user_gender[user_id] = gender
-        user_questions[user_id] = []  # Очищаємо питання, щоб оновити список під стать
+        question_bank.reset(user_id)  # Скидаємо курсор, щоб оновити питання під стать
         await update.message.reply_text(f"Окей! Тепер я буду спілкуватися з тобою як з {gender} ❤️")
     else:
         await update.message.reply_text("Некоректне значення. Вибери: /setgender чоловік або /setgender жінка.")
@@ -114,7 +120,7 @@ async def handle_message(update: Update, context: CallbackContext):
     user_text = update.message.text
     user_id = update.message.chat_id
 
-    ai_response = get_gemma_response(user_id, user_text)
+    ai_response = await asyncio.to_thread(get_gemma_response, user_id, user_text)
     await update.message.reply_text(ai_response)
 
     # Додаємо унікальне питання Ліззі після відповіді
@@ -123,13 +129,36 @@ async def handle_message(update: Update, context: CallbackContext):
         await update.message.reply_text(question)
 
 
+# Сторож циклу подій (налаштовується через LOOP_WATCHDOG* у .env)
+loop_watchdog = watchdog.from_env()
+if loop_watchdog:
+    loop_watchdog.guard(ollama, "chat")
+    loop_watchdog.guard(time, "sleep")
+    loop_watchdog.guard(os, "fsync")
+
+
+# Запуск сторожа і фонового збереження курсорів питань разом із циклом подій
+async def post_init(application: Application):
+    if loop_watchdog:
+        loop_watchdog.start()
+    application.bot_data["question_flush"] = asyncio.create_task(question_bank.flush_periodically())
+
+
+# Зупинка сторожа і фінальне збереження курсорів питань
+async def post_shutdown(application: Application):
+    if loop_watchdog:
+        loop_watchdog.stop()
+    application.bot_data["question_flush"].cancel()
+    question_bank.flush()
+
+
 # Функція запуску бота
 def run_telegram_bot():
     if not TOKEN:
         logger.error("❌ TELEGRAM_BOT_TOKEN не знайдено!")
         return
 
-    app = Application.builder().token(TOKEN).build()
+    app = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("setgender", set_gender))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))